@@ -20,12 +20,15 @@ import string   # for constants
 # for output:
 import time
 import csv
-import yaml
 import json
 
 import glob
+import bisect
 
 import logging
+import threading
+from urllib import quote
+from io import BytesIO
 
 # for shell processing:
 # using envoy in place of 'import subprocess'
@@ -40,14 +43,30 @@ from collections import Iterable
 from collections import deque
 
 # browser automation / interface:
-
-from urllib2 import build_opener  # for headless operation
-
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait # available since 2.4.0
-## uncomment when I need this:
-# from selenium.webdriver.support import expected_conditions as EC
+#  selenium is imported on first browser use (see import_selenium()),
+#  so headless runs start quickly, and run where there's no browser at all.
+webdriver = None  # pylint: disable= invalid-name
+
+from scrapelib import httppool  # keep-alive connections for headless operation
+from scrapelib import httpcache  # on-disk cache of headless fetches
+from scrapelib import snapshots  # saved browser renders, for replay
+from scrapelib import politeness  # per-host rate & concurrency limits
+from scrapelib import procmem  # for browser memory caps
+from scrapelib import selectors  # compiled selector cache
+from scrapelib import textindex  # offsets-to-elements, for search
+from scrapelib import corpus  # index of all opened pages, for 'corpus search'
+from scrapelib import stream  # streaming parses, and early stops
+from scrapelib import tablesink  # batch tables, written as inputs finish
+from scrapelib import columns  # compact storage of vars' values
+from scrapelib import outputs  # output files, kept open for a run
+
+def import_selenium():
+    'import selenium\'s webdriver, the first time a browser is needed'
+    global webdriver  # pylint: disable= global-statement, invalid-name
+    if webdriver is None:
+        from selenium import webdriver as selenium_webdriver
+        webdriver = selenium_webdriver
+    return webdriver
 
 # command processing
 
@@ -60,20 +79,25 @@ from selenium.webdriver.support.ui import WebDriverWait # available since 2.4.0
 #  Just say "no!" to cmd2.
 
 import cmd
-### the following, for command completion:
-import readline
-import rlcompleter
 
-if readline.__doc__.find('libedit') >= 0:
-    readline.parse_and_bind("bind ^I rl_complete")
-else:  # not sure if we need this; put for symmetry
-    readline.parse_and_bind("tab: complete")
+### the following, for command completion
+#  (interactive only: see MainCmd.preloop()):
+def setup_completion():
+    import readline
+    import rlcompleter  # pylint: disable= unused-variable
+
+    if readline.__doc__.find('libedit') >= 0:
+        readline.parse_and_bind("bind ^I rl_complete")
+    else:  # not sure if we need this; put for symmetry
+        readline.parse_and_bind("tab: complete")
 
 ### - end - command completion
 
 
 # and now for our local stuff:
 from scrapelib import plugins
+from scrapelib import batch
+from scrapelib import plan
 
 
 ## ---< for development use >---
@@ -153,7 +177,9 @@ text_getr = frozenset(
 
 ## Javascript functions:
 #  Grab the selection from the browser;
-#  - return the error message, and "null" if no selection.
+#  - return the error message, and "null" if no selection;
+#  - with the xpath (as lxml's getpath() makes them) and a css path
+#    of the selection's element, so grab can find it in the parsed page.
 #
 JS_GET_SELECTION = '''
 var oB = null;
@@ -161,6 +187,36 @@ var e = "";    // error msg;
 var s = "";    // selection string;
 var h = null;  // html context;
 var p = null;  // parent's html context;
+var x = null;  // xpath of the selection's element;
+var c = null;  // css path of it;
+function nth(el){  // position of el among its siblings of the same tag; 0 if it's the only one
+  var n = 1, only = true;
+  for (var i = el.previousElementSibling; i; i = i.previousElementSibling)
+    if (i.localName == el.localName){ n++; only = false; }
+  for (var i = el.nextElementSibling; i && only; i = i.nextElementSibling)
+    if (i.localName == el.localName){ only = false; }
+  return only ? 0 : n;
+}
+function xpath(el){
+  var path = "";
+  for (; el; el = el.parentElement){
+    var n = nth(el);
+    path = "/" + el.localName + (n ? "[" + n + "]" : "") + path;
+  }
+  return path;
+}
+function csspath(el){
+  var path = [];
+  for (; el; el = el.parentElement){
+    if (el.id && /^[A-Za-z][\\w-]*$/.test(el.id)){
+      path.unshift("#" + el.id);
+      break;
+    }
+    var n = nth(el);
+    path.unshift(el.localName + (n ? ":nth-of-type(" + n + ")" : ""));
+  }
+  return path.join(" > ");
+}
 try{
   oB = document.getSelection();
   if ( oB.rangeCount == 0 ){
@@ -173,14 +229,74 @@ try{
   s += obr.toString();
   h = obr.startContainer.parentElement.outerHTML;
   p = obr.startContainer.parentElement.parentElement.outerHTML;
+  x = xpath(obr.startContainer.parentElement);
+  c = csspath(obr.startContainer.parentElement);
 }
 catch(e) {
   e = "...An error has occurred: "+e.message
 }
 finally {
- return [e, s, h, p]
+ return [e, s, h, p, x, c]
 }'''
 
+#  Push-down extraction:  the page, reduced (in the browser) to the elements
+#  matching arguments[0] - a list of [kind ('css' or 'xpath'), selector] -
+#  and their ancestors (tags and attributes only);  null if a selector fails.
+#
+JS_EXTRACT = '''
+var MATCH = 1, ANCESTOR = 2;
+var marks = new Map();
+var keep = [];
+try{
+  var sels = arguments[0];
+  for (var i = 0; i < sels.length; i++){
+    if (sels[i][0] == 'css'){
+      var found = document.querySelectorAll(sels[i][1]);
+      for (var j = 0; j < found.length; j++)
+        keep.push(found[j]);
+    }
+    else{
+      var r = document.evaluate(sels[i][1], document.documentElement, null,
+                                XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+      for (var j = 0; j < r.snapshotLength; j++){
+        var n = r.snapshotItem(j);
+        // attributes and text:  keep the element they're of
+        n = (n.nodeType == 2) ? n.ownerElement : (n.nodeType == 1 ? n : n.parentNode);
+        if (n && n.nodeType == 1)
+          keep.push(n);
+      }
+    }
+  }
+}
+catch(e) {
+  return null;
+}
+for (var i = 0; i < keep.length; i++)
+  marks.set(keep[i], MATCH);
+keep.push(document.body);
+for (var i = 0; i < keep.length; i++){
+  for (var p = keep[i].parentElement; p && !marks.has(p); p = p.parentElement)
+    marks.set(p, ANCESTOR);
+}
+if (!marks.has(document.body))
+  marks.set(document.body, ANCESTOR);
+function esc(s){
+  return s.replace(/&/g, '&amp;').replace(/"/g, '&quot;').replace(/</g, '&lt;');
+}
+function out(el){
+  if (marks.get(el) == MATCH)
+    return el.outerHTML;
+  var s = '<' + el.localName;
+  for (var i = 0; i < el.attributes.length; i++)
+    s += ' ' + el.attributes[i].name + '="' + esc(el.attributes[i].value) + '"';
+  s += '>';
+  for (var c = el.firstElementChild; c; c = c.nextElementSibling)
+    if (marks.has(c))
+      s += out(c);
+  return s + '</' + el.localName + '>';
+}
+return out(document.documentElement);'''
+
 
 ## Logging configuration:
 
@@ -198,12 +314,13 @@ cformatter = logging.Formatter('scrape: %(levelname)s - %(message)s')
 hformatter = logging.Formatter('%(message)s')
 
 # TODO:  config log file name / place:
+# (delay: these files aren't created until something is logged to them)
 # File logging handler:
-fh = logging.FileHandler('scrape.log.txt')   # file logging
+fh = logging.FileHandler('scrape.log.txt', delay=True)   # file logging
 fh.setLevel(logging.DEBUG)
 fh.setFormatter(formatter)
 # History logging handler:
-hh = logging.FileHandler('scrape.script.txt') # history logging
+hh = logging.FileHandler('scrape.script.txt', delay=True) # history logging
 hh.setLevel(logging.INFO)
 hh.setFormatter(hformatter)
 # TODO   add option to log; may want 3rd handler:
@@ -242,6 +359,16 @@ uplugins_loaded = False  # pylint: disable= invalid-name
 #  or more concisely:
 #    uplugin[plugin_name].func()
 
+def load_plugins():
+    '''
+    load the plugins, once;
+    batch worker processes are forked after this, so they share them.
+    '''
+    global uplugin, uplugins_loaded  # pylint: disable=global-statement,invalid-name
+    if not uplugins_loaded:
+        uplugin = plugins.load(logger)
+        uplugins_loaded = True
+
 
 # for string parameter length control:
 # TODO:  make an option for setting this; maybe bring into the MainCmd() class;
@@ -289,7 +416,8 @@ def main():
     parser.add_argument('-f', '--input-files', nargs='?',
            help="a file containing input files or URLs, one per line; processed before any command line files")
     parser.add_argument('-o', '--output-file',
-           help="combine all table outputs into one file")
+           help="combine all table outputs into one file (csv; or by its suffix: .json, .jsonl, .yml; " \
+              + "compressed if it ends in .gz or .xz, e.g. out.jsonl.gz)")
     parser.add_argument('-O', '--overwrite', default=False, action='store_true',
            help="by default, written output and scripts roll numerically unique names;"  \
               + "this sets write mode to overwrite existing files.")
@@ -303,6 +431,71 @@ def main():
            help="warn if output cells are greater than maxcellsize (output not truncated, only warning issued)")
     parser.add_argument('--no-shell-glob', default=False, action='store_true',
            help="when running shell commands, file expansion (globbing) is in effect; this turns it off.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+           help="number of inputs to process concurrently in batch mode; " \
+              + "table outputs are merged in input order.")
+    parser.add_argument('--flush-rows', type=int, default=0,
+           help="in batch mode, table rows are written as each input finishes; " \
+              + "flush them to disk every this many rows (default: after each input).")
+    parser.add_argument('--partition', metavar='COLUMN',
+           help="in batch mode, write each table's rows into a file per value of COLUMN " \
+              + "(e.g. table-<journal>.csv), for tables which have it; " \
+              + "an input's rows without a value go with its value before them.")
+    parser.add_argument('--max-open-files', type=int, default=MainCmd.max_open_files,
+           help="most output files kept open at once (e.g. partitions); " \
+              + "outputs are written to temporary files, and moved into place when done.")
+    parser.add_argument('--pool-size', type=int, default=httppool.MAXSIZE,
+           help="idle keep-alive connections kept per host for headless fetches.")
+    parser.add_argument('--cache', nargs='?', const=http_cache.directory, metavar='CACHE_DIR',
+           help="cache headless fetches on disk (in CACHE_DIR, default: {}); ".format(http_cache.directory) \
+              + "re-runs are served from the cache. See also the 'cache' command.")
+    parser.add_argument('--cache-ttl', type=float, default=http_cache.ttl,
+           help="seconds a cached page is used before it's revalidated with the server.")
+    parser.add_argument('--cache-size', type=float, default=http_cache.max_bytes / 2**20,
+           help="megabytes of cached pages kept; least recently used pages are evicted first.")
+    parser.add_argument('--rate', type=float, default=host_scheduler.rate,
+           help="most requests per second made to any one host (default: no limit).")
+    parser.add_argument('--max-inflight', type=int, default=host_scheduler.max_inflight,
+           help="most concurrent requests to any one host; the limit in use adapts " \
+              + "to the server's latency, and to 429/503 responses. See: show hosts")
+    parser.add_argument('--snapshots', nargs='?', const=dom_snapshots.directory, metavar='SNAPSHOT_DIR',
+           help="save each page the browser renders in SNAPSHOT_DIR (default: {}).".format(dom_snapshots.directory))
+    parser.add_argument('--corpus', nargs='?', const=corpus_index.directory, metavar='CORPUS_DIR',
+           help="index the text of every page opened, in CORPUS_DIR (default: {}); ".format(corpus_index.directory) \
+              + "see the 'corpus' command.")
+    parser.add_argument('--replay', nargs='?', const=dom_snapshots.directory, metavar='SNAPSHOT_DIR',
+           help="open pages from their latest saved snapshots, without a browser. See also: --snapshots")
+    parser.add_argument('--browsers', type=int,
+           help="browsers to render with concurrently, in batch mode (default: the number of --jobs).")
+    parser.add_argument('--block', default='',
+           help="comma separated resources the browser shouldn't load: " \
+              + "images, media, fonts, css, or 'scrape' (images, media and fonts). See also: help block")
+    parser.add_argument('--block-hosts', default='',
+           help="comma separated hosts (e.g. third-party trackers) the browser shouldn't load from.")
+    parser.add_argument('--page-load', choices=Driver.PAGE_LOADS, default=Driver.page_load,
+           help="browser page load strategy: 'eager' returns at DOMContentLoaded, 'none' right away; " \
+              + "use the 'wait' command in scripts for the elements they need.")
+    parser.add_argument('--pushdown', action='store_true',
+           help="in batch mode, have the browser send back only the elements " \
+              + "the script selects, rather than whole pages. See also: help pushdown")
+    parser.add_argument('--stream', action='store_true',
+           help="in headless batch mode, run scripts which only select forward paths " \
+              + "(find, findall, cssselect; then text, content, attrib) as each input is parsed, " \
+              + "without building its whole tree: memory stays flat for very large inputs.")
+    parser.add_argument('--early', action='store_true',
+           help="in headless batch mode, stop reading a page once the script's finds " \
+              + "have all been parsed (for scripts which only take the first match " \
+              + "of forward find paths, e.g. of <head> meta tags).")
+    parser.add_argument('--max-bytes', type=int, default=0,
+           help="in headless batch mode, stop reading a page after this many bytes " \
+              + "(what's been read is parsed as the whole page; default: no limit).")
+    parser.add_argument('--recycle-pages', type=int, default=Driver.recycle_pages,
+           help="in batch mode, restart a browser after it loads this many pages (0: never).")
+    parser.add_argument('--recycle-mb', type=int, default=Driver.recycle_rss // 2**20,
+           help="in batch mode, restart a browser once it uses this much memory (0: never).")
+    parser.add_argument('-P', '--processes', type=int, default=1,
+           help="shard batch inputs across this many worker processes (headless only); " \
+              + "table outputs are merged in input order.")
 
     args = parser.parse_args()
     scrape = MainCmd()
@@ -311,15 +504,54 @@ def main():
 
     scrape.console_out = args.console_out
     scrape.single_output = args.output_file
+    if args.output_file:
+        try:
+            outputs.opener(args.output_file)
+        except IOError as e:
+            parser.error("-o: {}".format(e))
     scrape.headless = args.HEADLESS
     scrape.maxcellsize = args.maxcellsize
     scrape.overwrite = args.overwrite
+    scrape.flush_rows = args.flush_rows
+    scrape.partition = args.partition
+    scrape.max_open_files = output_files.max_open = args.max_open_files
     scrape.sh_glob = not args.no_shell_glob
-
-
+    scrape.pushdown = args.pushdown
+    scrape.stream = args.stream
+    scrape.early = args.early
+    scrape.max_bytes = args.max_bytes
+    http_pool.maxsize = args.pool_size
+    Driver.pool_size = args.browsers or max(args.jobs, args.processes)
+    try:
+        Driver().set_blocking(*parse_blocking(
+            [i for i in args.block.split(',') if i] + ['hosts=' + args.block_hosts]))
+    except ValueError as e:
+        parser.error("--block: unknown resource '{}'".format(e))
+    Driver().set_page_load(args.page_load)
+    Driver.recycle_pages = args.recycle_pages
+    Driver.recycle_rss = args.recycle_mb * 2**20
+    host_scheduler.rate = args.rate
+    host_scheduler.max_inflight = args.max_inflight
+    if args.cache:
+        http_cache.directory = args.cache
+        http_cache.enabled = True
+    http_cache.ttl = args.cache_ttl
+    http_cache.max_bytes = int(args.cache_size * 2**20)
+    if args.corpus:
+        corpus_index.directory = args.corpus
+        corpus_index.enabled = True
+    if args.snapshots:
+        dom_snapshots.directory = args.snapshots
+        dom_snapshots.recording = True
+    if args.replay:
+        dom_snapshots.directory = args.replay
+        dom_snapshots.replay = True
+
+
+    import atexit
     if not args.keep_browser:
-        import atexit
         atexit.register(Driver().close)
+    atexit.register(output_files.close)
 
     # Now, respond per command-line arguments
 
@@ -337,23 +569,19 @@ def main():
             )
             exit -1  # pylint: disable= pointless-statement
 
-        global BATCH, uplugin, uplugins_loaded  # pylint: disable=global-statement,invalid-name
+        global BATCH  # pylint: disable=global-statement,invalid-name
 
         BATCH = True
-        if not uplugins_loaded:
-            uplugin = plugins.load(logger)
-            uplugins_loaded = True
+        load_plugins()
+
+    # batch inputs: those from a file-list first, then the command line;
+    sources = []
 
     # first, process external sources from a file-list:
     if args.input_files:
         ensure(args.script, args.input_files)
         with open(args.input_files, "r") as f:  # pylint: disable=invalid-name
-            for line in f:
-                scrape.onecmd('open '+ line)
-                scrape.onecmd('load ' + args.script)
-                # TODO:  this would be a good place to put a timer
-                # - a decorator would be nice...
-                # - there's also a nice example of doing this with "with"
+            sources.extend(line.strip() for line in f if line.strip())
 
     # next, address any sources listed on the command line:
     if args.file_or_URL:
@@ -363,10 +591,17 @@ def main():
         #   process in batch mode
         if (not args.interactive and args.script) or len(args.file_or_URL) > 1:
             ensure(args.script, args.file_or_URL)
-        for f in args.file_or_URL:   # pylint: disable=invalid-name
-            scrape.onecmd('open '+ f)
-            if BATCH:
-                scrape.onecmd('load '+ args.script)
+        if BATCH:
+            sources.extend(args.file_or_URL)
+        else:
+            for f in args.file_or_URL:   # pylint: disable=invalid-name
+                scrape.onecmd('open '+ f)
+
+    if sources:
+        # TODO:  this would be a good place to put a timer
+        # - a decorator would be nice...
+        # - there's also a nice example of doing this with "with"
+        scrape.run_batch(sources, args.script, args.jobs, args.processes)
 
     # now, there are two more possibilities:
     #  - if we processed in batch, and also
@@ -412,7 +647,7 @@ class MainCmd(cmd.Cmd):
                 'var_name', 'table_name', 'tables',
                 'script', 'headless', 'overwrite',
                 'sh_hist', 'sh_glob', 'doc', 'completekey',
-                'cmd_trace', 'path',
+                'cmd_trace', 'path', 'hosts', 'selectors',
                  # later, will want to add:
                  # 'single_output', 'console_output',
                  )
@@ -439,7 +674,7 @@ class MainCmd(cmd.Cmd):
     # for BATCH processing, there is no history:
     history_append = lambda self, s: None if BATCH else self.history.append(s)
 
-    name_overwrite = lambda self, s: s if self.overwrite else roll_name(s)
+    name_overwrite = lambda self, s: s if self.overwrite else outputs.roll_name(s)
 
     # TODO:  (plugins):
     #  To accomodate plugin operations, need to break these out of this structure:
@@ -456,9 +691,10 @@ class MainCmd(cmd.Cmd):
     var_name = None   # current name in play
     # These are the dicts which contain the vars
     #   - naming to avoid conflict svars => scrape vars
-    svars = {}
-    slocals = {}   # persist per URI/file
-    sglobals = {}   # per per session
+    #   - each a columns.Table:  {name: columns.Column}
+    svars = columns.Table()
+    slocals = columns.Table()   # persist per URI/file
+    sglobals = columns.Table()   # per per session
     _sv = {}   # the reverse lookup: var:scope-table
 
     # default to the currently active var:
@@ -467,6 +703,8 @@ class MainCmd(cmd.Cmd):
 
     # search:
     _search_anchor = 0
+    # the text index of the doc last searched (see textindex.py)
+    _text_index = None
 
     # each table name holds it's output
     # - when a new table is encountered, push current output to
@@ -485,10 +723,246 @@ class MainCmd(cmd.Cmd):
     table_ordered_keys = []
     default_table_name = 'scrape_table'
 
+    # per-host fetch scheduling (see --rate, --max-inflight); for "show hosts":
+    hosts = property(lambda self: host_scheduler.stats())
+    # compiled selector cache size, hits and misses; for "show selectors":
+    selectors = property(lambda self: selectors.cache.stats())
+
+    # seconds 'wait' waits, by default:
+    wait_timeout = 10
+
     # script is the name of the last loaded script
     script = None
     script_default = 'script.scrape'
 
+    # batch workers collect written tables here (rather than writing them),
+    #  so they can be merged, in input order, by the main MainCmd:
+    table_sink = None
+    # settings a batch worker inherits from the MainCmd which spawned it:
+    settings = ('populous', 'console_out', 'single_output', 'headless',
+                'maxcellsize', 'overwrite', 'sh_glob', 'pushdown', 'stream',
+                'early', 'max_bytes')
+
+    # streaming runs (see --stream):  headless batch inputs are parsed as a
+    #  stream, and never built into a whole tree, when the script allows it;
+    stream = False
+
+    # early stops (see --early):  headless batch fetches stop reading a page
+    #  once a script which only finds has parsed all it finds;
+    early = False
+    # ...or (if not 0) after this many bytes of it:
+    max_bytes = 0
+    # ...the script (its stream.StreamScript) for the page being opened:
+    until = None
+
+    # tables written outside of batches to one output (-o) go through this:
+    single_sink = None
+
+    # batch table outputs are flushed after each input, or (if not 0)
+    #  every flush_rows rows (see --flush-rows);
+    flush_rows = 0
+    # ...split into a file per value of this column (see --partition):
+    partition = None
+    # ...through no more than this many open files:
+    max_open_files = 64
+
+    # push-down extraction (see 'help pushdown'):  when on, batch pages
+    #  rendered in a browser are reduced there to what the script selects;
+    pushdown = False
+    # ...the (kind, selector)s for the page being opened:
+    extract = None
+    # script commands which leave the page alone, or only use the elements
+    #  the script's selectors pick out (by their canonical do_* names):
+    pushdown_safe = frozenset([
+        'var', 'local', 'global', 'table', 'clear', 'set',
+        'text', 'tail', 'content', 'attrib', 'root', 'body',
+        'nodes', 'tags', 'show', 'wait', 'csv', 'json', 'yaml',
+        'populous', 'sparse', 'overwrite', 'roll', 'glob', 'noglob', 'shell',
+        ])
+
+    def __init__(self, *args, **kwargs):
+        cmd.Cmd.__init__(self, *args, **kwargs)
+        # scrape state is per instance, so batch workers don't share it:
+        self.svars = columns.Table()
+        self.slocals = columns.Table()
+        self.sglobals = columns.Table()
+        self._sv = {}
+        self.tables = deque()
+        self.cmd_trace = deque()
+        self.sh_hist = deque()
+        self.table_ordered_keys = []
+
+    def spawn(self):
+        'return a new MainCmd with our settings, but its own scrape state'
+        # a no-op when plugins were loaded before worker processes forked:
+        load_plugins()
+        worker = MainCmd()
+        for setting in self.settings:
+            setattr(worker, setting, getattr(self, setting, None))
+        worker.table_sink = []
+        return worker
+
+    def reset_tables(self):
+        'start a new input with empty tables and vars (globals persist)'
+        self.svars = columns.Table()
+        self.slocals = columns.Table()
+        self._sv = {k: v for k, v in self._sv.items() if v is self.sglobals}
+        self.tables = deque()
+        self.table_ordered_keys = []
+        self.table_name = None
+        self.var_name = None
+
+    def run_source(self, source, script):
+        '''
+        (batch worker) open source, and run script over it;
+        returns the (table_name, table, key_order) tables it wrote.
+        '''
+        self.reset_tables()
+        self.table_sink = []
+        # pages rendered through a browser get one of their own from the pool:
+        browsing = not (self.headless or dom_snapshots.replay)
+        if browsing:
+            Driver().checkout()
+            self.extract = self.pushdown_extract(script)
+        else:
+            self.until = self.early_until(script)
+        try:
+            if browsing or not self.stream_source(source, script):
+                self.onecmd('open ' + source)
+                self.onecmd('load ' + script)
+        finally:
+            self.extract = self.until = None
+            if browsing:
+                Driver().checkin()
+        written, self.table_sink = self.table_sink, []
+        return written
+
+    def stream_source(self, source, script):
+        '''
+        (--stream) run script over source as it's parsed, without building
+        its whole tree;  False (having done nothing) if streaming is off,
+        or script can't be run that way.
+        '''
+        if not self.stream:
+            return False
+        try:
+            compiled = plan.load(script, self)
+        except (IOError, OSError):
+            return False   # 'load' reports it
+        if compiled.stream is None:
+            return False
+        self.script = script
+        self.doc = self.node = self.root = None
+        try:
+            f = stream_page(source)
+            try:
+                streamed = compiled.stream.run(f, self.early, self.max_bytes)
+            finally:
+                if hasattr(f, 'close'):
+                    f.close()
+        except (IOError, etree.LxmlError) as e:
+            logger.error("{}: {}".format(source, e))
+            return True
+        compiled.run(self, streamed)
+        return True
+
+    def streamed(self, values, line):
+        '''
+        a script step already done by a streaming run (see stream_source):
+        its values (None for a selection step) go to the current var.
+        '''
+        if values:
+            if self.var_name:
+                self._sv[self.var_name][self.var_name].extend(values)
+            else:
+                logger.info("no current variable; values are: {}".format(values))
+        self.history_append(line)
+
+    def early_until(self, script):
+        'the StreamScript a headless fetch for script can stop at (None, if --early is off, or it can\'t)'
+        if not self.early:
+            return None
+        try:
+            compiled = plan.load(script, self).stream
+        except (IOError, OSError):
+            return None   # 'load' reports it
+        return compiled if compiled is not None and compiled.bounded else None
+
+    def pushdown_extract(self, script):
+        'the push-down extraction selectors for script (None, if pushdown is off, or it can\'t be)'
+        if not self.pushdown:
+            return None
+        try:
+            return plan.load(script, self).extract
+        except (IOError, OSError):
+            return None   # 'load' reports it
+
+    def apply_profile(self, script):
+        'run script\'s browser profile commands (e.g. block), before inputs are opened'
+        try:
+            profile = plan.load(script, self).profile
+        except (IOError, OSError):
+            return   # 'load' reports it
+        for handler, arg in profile:
+            handler(self, arg)
+
+    def run_batch(self, sources, script, jobs=1, processes=1):
+        '''
+        run script over each of sources;
+        with jobs > 1 (threads) or processes > 1, sources are processed
+        concurrently by worker MainCmd's;  either way, each input's tables
+        are appended to their outputs as it finishes, in input order.
+        '''
+        browsing = not (self.headless or dom_snapshots.replay)
+        if processes > 1 and browsing:
+            logger.warn("--processes requires headless (-H) operation, or --replay; using --jobs instead.")
+            jobs, processes = max(jobs, processes), 1
+        if browsing:
+            self.apply_profile(script)
+        if jobs > 1 and browsing:
+            Driver().prestart()
+        if self.stream and not browsing and os.path.isfile(script) \
+           and plan.load(script, self).stream is None:
+            logger.warn("--stream: '{}' can't be run over a stream (it uses more ".format(script) \
+                + "than forward find/findall/cssselect paths); reading whole inputs.")
+        if self.early and not browsing and os.path.isfile(script) \
+           and self.early_until(script) is None:
+            logger.warn("--early: '{}' takes more than the first matches of ".format(script) \
+                + "forward find paths; reading whole pages.")
+        # each input's tables are written as it finishes, in input order:
+        sink = tablesink.TableSink(
+            self.populous, self.flush_rows, self.maxcellsize,
+            console=None if self.single_output else self.stdout,
+            to_files=bool(self.single_output) or not self.console_out,
+            single_output=self.single_output,
+            roll=not self.overwrite, report=self.report_fn,
+            partition=self.partition, max_open=self.max_open_files)
+        def merge(source, written):
+            for name, table, key_order in written:
+                sink.add(name, table, key_order)
+        try:
+            if jobs <= 1 and processes <= 1:
+                self.extract = self.pushdown_extract(script) if browsing else None
+                self.until = None if browsing else self.early_until(script)
+                try:
+                    for source in sources:
+                        self.reset_tables()
+                        self.table_sink = []
+                        if browsing or not self.stream_source(source, script):
+                            self.onecmd('open ' + source)
+                            self.onecmd('load ' + script)
+                        written, self.table_sink = self.table_sink, None
+                        merge(source, written)
+                finally:
+                    self.extract = self.until = None
+                    self.table_sink = None
+            elif processes > 1:
+                batch.run_processes(sources, script, self.spawn, processes, merge)
+            else:
+                batch.run_threads(sources, script, self.spawn, jobs, merge)
+        finally:
+            sink.close()
+
     # pylint: disable=unused-argument
     def complete_file(self, text, line, begidx, endidx):
         '''
@@ -507,12 +981,11 @@ class MainCmd(cmd.Cmd):
         # self.root = self.doc.getroottree()
         # self.node = self.doc
         # TODO:  get / log history to a user file;
-        global BATCH, uplugin, uplugins_loaded  # pylint: disable=global-statement, invalid-name
+        global BATCH  # pylint: disable=global-statement, invalid-name
 
         BATCH = False
-        if not uplugins_loaded:
-            uplugin = plugins.load(logger)
-            uplugins_loaded = True
+        setup_completion()
+        load_plugins()
         self.history = History()
         ##  I think I prefer to not do this by default:
         # self.onecmd("open")  # open the browser, w/o url in interactive;
@@ -604,65 +1077,78 @@ class MainCmd(cmd.Cmd):
         logger.error("Unrecognized command: {}".format(line))
         return
 
-    def report_fn(self, fname):
+    def report_fn(self, fname, size=None):
         "report on the results (size) of a file"
         # don't use logger for this - always report this
         self.stderr.write("wrote {} bytes to {}\n".format(
-            os.stat(fname).st_size, fname))
+            os.stat(fname).st_size if size is None else size, fname))
 
-    def write_table(self, name, table, output=None):
+    def write_table(self, name, table, output=None, key_order=None):
         '''
         if output specified, then no output to stdout;
         otherwise output to stdout, and to the table_name.csv, in a rolling fashion;
+        key_order defaults to the order the current table's columns were declared.
         '''
+        if key_order is None:
+            key_order = self.table_ordered_keys
+        # pad out the (stored) columns:  values scraped into them
+        #  after this go on the rows after these
+        table.pad(self.populous)
+        if self.table_sink is not None:
+            # batch worker: hand a copy back, to be merged in input order
+            self.table_sink.append((name, table.copy(), list(key_order)))
+            return
         # write out the csv
         keys = list(table.keys())
-        key_order = self.table_ordered_keys
         # since we're going to output in the order the table columns were defined,
         #  let's do a basic sanity check:
         if len(keys) != len(key_order):
             logger.error("something is wrong: size of table keys, and their ordered list mismatch!")
             key_order = keys   # abort the ordered list, but at least preserve what we can
-        maxlen = max([len(table[i]) for i in keys])
+        if self.single_output:
+            # one output (csv, or by its suffix, json lines, yaml, ...),
+            #  kept open (and appended to) for the session:
+            if self.single_sink is None:
+                self.single_sink = tablesink.TableSink(single_output=self.single_output,
+                                                       files=output_files)
+            sink = self.single_sink
+            sink.populous, sink.maxcellsize = self.populous, int(self.maxcellsize)
+            output_files.roll = not self.overwrite
+            sink.add(name, table, key_order)
+            output_files.publish()   # (as it is so far:  it's closed at exit)
+            output = sink.filename(name)
+            self.report_fn(output_files.name(output), output_files.size(output))
+            return
 
-        # Pad out the columns:
-        for k in keys:
-            repl = table[k][-1] if self.populous else ''
-            table[k].extend([repl] * (maxlen - len(table[k])))
         # TODO:  handle errors based on encoding you can't encode (unicode instead of string?)
         # encoding = self.root.docinfo.encoding
         ## SOrry: csv writer only does UTF-8
         encoding = 'utf-8'
-        # table_rows = [[table[j][i].encode(encoding=encoding) for j in keys] for i in range(maxlen)]
-        # table_rows = [[table[j][i] for j in key_order] for i in range(maxlen)]
-        table_rows = [[table[j][i].encode(encoding) for j in key_order] for i in range(maxlen)]
+        # rows are read out of the columns (short ones padded) as they're written:
+        table_rows = lambda: ([c.encode(encoding) for c in row]
+                              for row in table.rows(key_order, self.populous))
         # Warn about unusually long items, which might cause problems in csv cells
-        maxcell = max([len(item) for sublist in table_rows for item in sublist])
-        if maxcell > self.maxcellsize:
+        maxcell = table.maxsize()
+        if maxcell > int(self.maxcellsize):
             logger.warn("max output item size is {};".format(maxcell))
 
         # TODO: write to stdout for development;
         #  - later, decide how they want table output named;
-        if self.single_output:
-            output = self.single_output
-            mode = "a"
-        else:
-            mode = "w"
-            if isinstance(output, types.NoneType):
-                cc = csv.writer(self.stdout)  # pylint: disable=invalid-name
-                # output header and body:
-                cc.writerow(key_order)
-                cc.writerows(table_rows)
-
-            if self.console_out == True:   # only output to console
-                return
-            # use the table's name for a filename:
-            output = name
+        if isinstance(output, types.NoneType):
+            cc = csv.writer(self.stdout)  # pylint: disable=invalid-name
+            # output header and body:
+            cc.writerow(key_order)
+            cc.writerows(table_rows())
+
+        if self.console_out == True:   # only output to console
+            return
+        # use the table's name for a filename:
+        output = name
         ofname = self.name_overwrite(str(output)+'.csv')
-        with must_open(ofname, mode) as f:  # pylint: disable=invalid-name
+        with must_open(ofname, "w") as f:  # pylint: disable=invalid-name
             cw = csv.writer(f)  # pylint: disable=invalid-name
             cw.writerow(key_order)
-            cw.writerows(table_rows)
+            cw.writerows(table_rows())
         self.report_fn(ofname)
 
     # def do_csv(self, line):
@@ -682,6 +1168,9 @@ class MainCmd(cmd.Cmd):
 
            write the current table out in JSON form to [table-name].json,
            or file_name (if given).  file_name will overwrite, regardless of 'overwrite' setting.
+
+           a file_name ending in .jsonl is written as JSON lines:  a record per row;
+           ending in .gz or .xz (e.g. out.jsonl.gz), it's compressed.
         '''
 
         # pylint: disable=invalid-name
@@ -690,11 +1179,16 @@ class MainCmd(cmd.Cmd):
         #   prevent an exception in case there is no table_name
         #    (table_name is None); instead, we just write nothing to "None.json"
         if len(line) > 0:
-            fn = line if line.endswith('.json') else line+".json"
+            fn = line if tablesink.output_format(line) in ('json', 'jsonl') else line+".json"
         else:
             fn = self.name_overwrite(str(self.table_name)+".json")
-        with must_open(fn, 'w') as f:
-            json.dump(self.svars, f)
+        with outputs.open_file(fn, 'wb') as f:
+            if tablesink.output_format(fn) == 'jsonl':   # a record per row
+                order = [k for k in self.table_ordered_keys if k in self.svars] \
+                      + [k for k in self.svars if k not in self.table_ordered_keys]
+                tablesink.row_format(fn).rows(f, order, self.svars.rows(order, self.populous), 0)
+            else:
+                json.dump(self.svars.tolists(), f)
         self.report_fn(fn)
         self.history_append('json '+line)
         # pylint: enable=invalid-name
@@ -704,14 +1198,18 @@ class MainCmd(cmd.Cmd):
 
            write the current table out in YAML form to [table-name].yml,
            or file_name (if given).  file_name will overwrite, regardless of 'overwrite' setting.
+
+           a file_name ending in .gz or .xz (e.g. out.yml.gz) is compressed.
         '''
+        import yaml  # deferred: only needed for output / display
         # pylint: disable=invalid-name
         if len(line) > 0:
-            fn = line if line.endswith('.yml') else line+".yml"
+            fn = line if tablesink.output_format(line) == 'yaml' else line+".yml"
         else:
             fn = self.name_overwrite(str(self.table_name)+".yml")
-        with must_open(fn, 'w') as f:
-            yaml.dump(self.svars, f, default_flow_style=False)
+        with outputs.open_file(fn, 'wb') as f:
+            yaml.dump(self.svars.tolists(), f, Dumper=tablesink.yaml_dumper(),
+                      default_flow_style=False)
         self.report_fn(fn)
         self.history_append('yaml '+line)
         # pylint: enable=invalid-name
@@ -727,20 +1225,21 @@ class MainCmd(cmd.Cmd):
            n: 2 - find xpath for the parent tree
            n: 3 - (default) find xpath for the selected text only
 
-           Note: for 1, 2:  finding instances extremely unlikely, as
-                 order of tags returned from browser will vary;
+           The browser works out where the selection is (its xpath and
+           css path), and that is looked up in the parsed page;  if the page
+           has changed since it was opened, the selection is searched for.
 
         '''
         # this is static, so it the channel only gets created once
         browser = Driver().browser
-        # returned list: [error, text, context, parent]
+        # returned list: [error, text, context, parent, xpath, css path]
         #  - save for later showing, if desired
         # ugh! => encode it all to utf-8:
         self.grab = browser.execute_script(JS_GET_SELECTION)
         if self.nonblank:
             grab = []
             for val in self.grab:
-                grab.append(no_blanks(val))
+                grab.append(no_blanks(val) if val else val)
         else:
             grab = self.grab
 
@@ -754,7 +1253,7 @@ class MainCmd(cmd.Cmd):
             pass  # write some warning
 
         # pylint: disable=star-args
-        self.stdout.write("\t{}\ntext:\n\t{}\n\nhtml:\n\t{}\n\nparent html:\n\t{}\n\n".format(*grab))
+        self.stdout.write("\t{}\ntext:\n\t{}\n\nhtml:\n\t{}\n\nparent html:\n\t{}\n\n".format(*grab[:4]))
         # pylint: enable=star-args
 
         # pylint: disable=invalid-name
@@ -770,15 +1269,33 @@ class MainCmd(cmd.Cmd):
                 return
         # pylint: enable=invalid-name
 
+        # look up where the browser says the selection is, in the entire doc:
+        found = None
+        for compile_, sel in ((selectors.cache.xpath, grab[4]), (selectors.cache.css, grab[5])):
+            if not sel or self.doc is None:
+                continue
+            try:
+                found = next((i for i in compile_(sel)(self.doc) if isinstance(i, etree._Element)), None)
+            except (SyntaxError, etree.XPathError, selectors.SelectorError):
+                continue
+            if found is not None:
+                break
+        if found is not None:
+            for _ in range(3 - n):   # the parent tree, or the parent's parent
+                found = found.getparent() if found.getparent() is not None else found
+            tree = found.getroottree()
+            path = tree.getpath(found)
+            path = '.' + path[len(tree.getpath(self.doc)):]
+            self.stdout.write("----- xpath: -----\n{}\n\n".format(path))
+            self.path = path
+            return
+
         # Be sure to run this screen selection against the entire doc
         # - save and restore the current node
         stack = deque()
         stack.append(self.node)
         self.node = self.doc
-        # search_string = re.escape(grab[-n]))
-        # search_string = grab[-n].encode('unicode-escape')
-        # self.onecmd("search "+search_string)
-        self.onecmd("search "+grab[-n])
+        self.onecmd("search "+grab[4-n])
         # now restore the previous
         self.node = stack.pop()
 
@@ -909,7 +1426,7 @@ class MainCmd(cmd.Cmd):
                 self.headless = False
 
         try:
-            self.doc = open_tree(fn, self.headless)
+            self.doc = open_tree(fn, self.headless, self.extract, self.until, self.max_bytes)
         except IOError as e:
             logger.error('{}'.format(e.message))
             if arg:
@@ -922,10 +1439,211 @@ class MainCmd(cmd.Cmd):
         self.root = None if self.doc is None else self.doc.getroottree()
         self.node = self.doc
         # locals need to be cleared
-        self.slocals = {}
+        self.slocals = columns.Table()
 
     do_scrape = do_open
 
+    def do_cache(self, arg):
+        '''usage:  cache [on | off | clear | stats]
+
+        Cache headless fetches on disk, so re-running a script (or a batch)
+        doesn't fetch its pages again:
+
+          on     - use the cache (pages fresher than the cache ttl are
+                   used as is; older ones are revalidated with the server);
+          off    - fetch everything from the network (the default);
+          clear  - remove all the cached pages;
+          stats  - show the cache settings, size and hits (the default).
+
+        See also the --cache, --cache-ttl and --cache-size command line options.
+        '''
+        arg = arg.strip()
+        if arg == 'on':
+            http_cache.enabled = True
+        elif arg == 'off':
+            http_cache.enabled = False
+        elif arg == 'clear':
+            http_cache.clear()
+        elif arg in ('', 'stats'):
+            import yaml  # deferred: only needed for output / display
+            self.stdout.write(yaml.dump(http_cache.stats(), default_flow_style=False))
+            return
+        else:
+            logger.error("cache: unknown argument '{}'; try 'help cache'".format(arg))
+            return
+        self.history_append('cache ' + arg)
+
+    def do_corpus(self, arg):
+        '''usage:  corpus [on | off | clear | stats | search words...]
+
+        Index the text of every page opened (and find pages by their text):
+
+          on      - index each page as it's opened;  re-opened pages are
+                    re-indexed only if their text changed;
+          off     - stop indexing (the default);
+          clear   - remove all pages from the index;
+          stats   - show the index location, and its number of pages and words
+                    (the default);
+          search  - list the indexed pages containing all the words, each
+                    with the xpath of the element enclosing where they are.
+                    For example:
+
+                        corpus search Author Affiliations
+
+        See also the --corpus command line option.
+        '''
+        args = arg.split(None, 1)
+        cmd = args[0] if args else 'stats'
+        if cmd == 'on':
+            corpus_index.enabled = True
+        elif cmd == 'off':
+            corpus_index.enabled = False
+        elif cmd == 'clear':
+            corpus_index.clear()
+        elif cmd == 'stats':
+            import yaml  # deferred: only needed for output / display
+            self.stdout.write(yaml.dump(corpus_index.stats(), default_flow_style=False))
+            return
+        elif cmd == 'search' and len(args) == 2:
+            found = corpus_index.search(args[1])
+            for url, path in found:
+                self.stdout.write("{}\n\t{}\n".format(url, path))
+            self.stdout.write("----- {} pages found. -----\n".format(len(found)))
+        else:
+            logger.error("corpus: unknown argument '{}'; try 'help corpus'".format(arg))
+            return
+        self.history_append('corpus ' + arg)
+
+    def do_pushdown(self, arg):
+        '''usage:  pushdown [on | off]
+
+        Push-down extraction, for batch runs through a browser:  rather than
+        sending the whole rendered page back, the browser evaluates the
+        script's selectors (find, findall, cssselect), and sends back only the
+        elements they match, with their ancestors' tags and attributes.
+        On large pages, this cuts transfer and parse time a lot.
+
+        Scripts which use anything but those selectors to move around the
+        page (e.g. getparent, getnext, search, positions like li[2]) can't be
+        pushed down;  they (and pages where it fails) get the whole page.
+
+        With no argument, shows the setting.  See also --pushdown.
+        '''
+        arg = arg.strip()
+        if arg in ('on', 'off'):
+            self.pushdown = arg == 'on'
+            self.history_append('pushdown ' + arg)
+        elif not arg:
+            self.stdout.write("pushdown: {}\n".format('on' if self.pushdown else 'off'))
+        else:
+            logger.error("pushdown: unknown argument '{}'; try 'help pushdown'".format(arg))
+
+    def do_block(self, arg):
+        '''usage:  block [images] [media] [fonts] [css] [scrape] [none] [hosts=HOST,...]
+
+        Set what the browser won't load;  we only scrape its DOM, so
+        pages load faster without images, media, fonts (or even css).
+
+          scrape     - shorthand for images, media and fonts;
+          none       - load everything (the default);
+          hosts=...  - comma separated hosts (e.g. third-party trackers) not to load from.
+
+        With no arguments, shows what's blocked.  This overrides --block and --block-hosts,
+        e.g. for a script which needs css.  A browser already open is restarted (before its
+        next page) to apply a change;  in a batch script, it applies from the first input on.
+        '''
+        words = arg.split()
+        if not words:
+            self.stdout.write("blocking: {}\nhosts: {}\n".format(
+                ', '.join(sorted(Driver.blocking)) or 'none',
+                ', '.join(Driver.blocked_hosts) or 'none'))
+            return
+        try:
+            Driver().set_blocking(*parse_blocking(words))
+        except ValueError as e:
+            logger.error("block: unknown resource '{}'; try 'help block'".format(e))
+            return
+        self.history_append('block ' + arg)
+
+    def do_pageload(self, arg):
+        '''usage:  pageload [normal | eager | none]
+
+        Set how long opening a page in the browser waits:
+
+          normal  - until the page (with all its images, frames...) has loaded;
+          eager   - until the document is parsed (DOMContentLoaded);
+          none    - not at all.
+
+        With eager or none, use 'wait' for the elements a script needs.
+        With no argument, shows the current setting.  See also --page-load.
+        In a batch script, it applies from the first input on.
+        '''
+        arg = arg.strip()
+        if not arg:
+            self.stdout.write("{}\n".format(Driver.page_load))
+            return
+        try:
+            Driver().set_page_load(arg)
+        except ValueError:
+            logger.error("pageload: must be one of {}".format(', '.join(Driver.PAGE_LOADS)))
+            return
+        self.history_append('pageload ' + arg)
+
+    def do_wait(self, line):
+        '''usage:  wait [seconds] css|xpath selector
+
+        Wait (at most seconds, default 10) until an element matching the
+        css selector or xpath expression is present in the browser's page,
+        then re-read the page.  For example:
+
+            wait css div.abstract
+            wait 20 xpath //meta[@name="citation_title"]
+
+        With a quick page load strategy (see pageload), this lets a script
+        start as soon as the elements it scrapes exist.
+        Without a browser (headless), this only checks the element is present.
+        '''
+        args = line.split(None, 1)
+        timeout = self.wait_timeout
+        if args and re.match(r'^[0-9.]+$', args[0]):
+            timeout = float(args[0])
+            args = args[1].split(None, 1) if len(args) > 1 else []
+        if len(args) != 2 or args[0] not in ('css', 'xpath'):
+            logger.error("usage:  wait [seconds] css|xpath selector")
+            return
+        kind, selector = args
+        self.history_append('wait ' + line)
+
+        if self.headless or dom_snapshots.replay:  # the tree is all there is
+            try:
+                found = self.doc is not None and (
+                    selectors.cache.css(selector) if kind == 'css'
+                    else selectors.cache.xpath(selector))(self.doc)
+            except (etree.XPathError, SyntaxError, selectors.SelectorError) as e:
+                logger.error("wait: invalid {} '{}': {}".format(kind, selector, e))
+                return
+            if not found:
+                logger.warn("wait: '{}' is not in the page.".format(selector))
+            return
+
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        browser = Driver().browser
+        by = By.CSS_SELECTOR if kind == 'css' else By.XPATH
+        try:
+            WebDriverWait(browser, timeout).until(
+                EC.presence_of_element_located((by, selector)))
+        except TimeoutException:
+            logger.warn("wait: '{}' not present after {}s; using the page as it is."
+                        .format(selector, timeout))
+        # now re-read the page:
+        self.doc = open_tree('', extract=self.extract)
+        self.root = None if self.doc is None else self.doc.getroottree()
+        self.node = self.doc
+
     def do_close(self, arg):
         "close:  close the current browser connection (sets mode to 'headless')"
         Driver().close()
@@ -1033,6 +1751,8 @@ class MainCmd(cmd.Cmd):
             'var': "the current output var being processed.",
             'var_name': "an alias for 'var'",
             'headless': "shows setting; headless means without browser.",
+            'hosts': "per-host fetch limits, queue depth (waiting) and wait times.",
+            'selectors': "compiled selector cache: size, hits and misses.",
             }
         this_header = "Available items to show (type 'help show <topic>', or 'help show all'):"
         self.stdout.write("show:\n")
@@ -1121,6 +1841,9 @@ class MainCmd(cmd.Cmd):
                 print("{}stderr:{}\n{}".format('_' * 8, '_' * 8, show_what.std_err))
                 print('=' * 18)
             elif isinstance(show_what, dict):
+                import yaml  # deferred: only needed for output / display
+                if isinstance(show_what, columns.Table):
+                    show_what = show_what.tolists()
                 print(yaml.dump(show_what, default_flow_style=False))
             else:
                 print(show_what)
@@ -1133,18 +1856,15 @@ class MainCmd(cmd.Cmd):
     complete_load = complete_file
     def do_load(self, filename):
         '''usage:  load file
-        Load and run commands from file.'''
+        Load and run commands from file.
+
+        The script is compiled once, and the compiled form reused
+        (e.g. for each input in batch mode) until the file changes.'''
         self.script = filename
         try:
-            with must_open(filename) as f:
-                for line in f:
-                    line = self.precmd(line)
-                    # TODO:  decide if you'd rather let this run self.emptyline(),
-                    #       or always skip blank lines in "load", regardless...
-                    if line:
-                        self.onecmd(line)
+            plan.load(filename, self).run(self)
         except Exception as e:
-            logger.warn("{}".format(e.message))
+            logger.warn("{}".format(e))
             pass
 
     # use file-name completion here too
@@ -1219,7 +1939,7 @@ class MainCmd(cmd.Cmd):
             #    then refuse to write, and issue a message;
             if not tables:
                 logger.warn("No table name previously declared; using the name '{}'.".format(self.default_table_name))
-                tables.append((self.default_table_name, {}))
+                tables.append((self.default_table_name, columns.Table()))
                 self.table_name = self.default_table_name
             if tables:
                 (name, nout) = tables.pop()
@@ -1231,16 +1951,16 @@ class MainCmd(cmd.Cmd):
                 # if tables, resume saved output
                 ##
                 # handle case where tables.pop() left us empty tables:
-                out = tables[-1][1] if tables else {}
+                out = tables[-1][1] if tables else columns.Table()
         else:
             if tables:  # save pending output
                 # TODO:  going to need to rethink this:
                 # TODO:  going to also need to save key-order
                 tables[-1][1].update(out)
-            tables.append((name, {}))
+            tables.append((name, columns.Table()))
             self.table_name = name  # for show command
             # TODO:  revamp anything address "out" w.r.t. var class / structure;
-            self.svars = {}
+            self.svars = columns.Table()
             self.table_ordered_keys = []
 
         self.history_append("table " + name)
@@ -1318,7 +2038,7 @@ class MainCmd(cmd.Cmd):
         if arg:
             ordered_keys = lambda a: a   # essentially, a no-op
             # if the value exists in some other scope, simply move it
-            val = []
+            val = columns.Column()
             clearing = argtype.startswith('c')
 
             if clearing:
@@ -1443,7 +2163,7 @@ class MainCmd(cmd.Cmd):
             lvars = [lv.strip()]
         for i in lvars:
             if not i in self._sv:
-                self.svars.update({i: []})
+                self.svars.update({i: columns.Column()})
                 self.table_ordered_keys.append(i)
                 self._sv[i] = self.svars
 
@@ -1587,7 +2307,13 @@ class MainCmd(cmd.Cmd):
             return
         path, matchstr = result[0]+"/text()", result[1]
 
-        matching = [s for s in self.node.xpath(path) if matchstr in s]
+        try:
+            text_path = selectors.cache.xpath(path)
+        except etree.XPathError as e:
+            logger.error("{}: you need a valid XPATH here.".format(e))
+            return
+        nodes = self.node if isinstance(self.node, list) else [self.node]
+        matching = [s for node in nodes for s in text_path(node) if matchstr in s]
 
         mn = len(matching)
         if mn == 0:
@@ -1728,77 +2454,68 @@ class MainCmd(cmd.Cmd):
                 return
 
         ###
-        nodestr = etree.tostring(node, encoding='unicode')[start:]
-
-        # try with a RE search first - multiline;
-        match = re.search(line, nodestr, re.M)
-        if match:
-            (mstart, mend) = match.span()
-            matches = re.findall(line, nodestr)
-        # if no match, then fall back: attempt a simple find:
-        else:
-            mstart = nodestr.find(line)
-            if mstart >= 0:
-                mend = mstart + len(line)
-                # escape the line:
-                search_string = line.encode('unicode-escape')
-                # matches = re.findall(re.escape(line), nodestr)
-                matches = re.findall(search_string, nodestr, re.M)
+        if isinstance(node, list):
+            node = node[0]
+        # the document's markup is serialized (and indexed) once per open:
+        try:
+            index = self.text_index(node)
+            nstart, nend = index.span(node)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error("searchtext: can't search {}: {}".format(node, e))
+            return
+        nodestr = index.text  # offsets below are into the whole doc's markup
+
+        # a RE search first - multiline; if no match, a simple find:
+        spans = index.matches(line, nstart, nend)
+        i = bisect.bisect_left(spans, (nstart + start,))
+        if i == len(spans):
             # TODO:  actually, we'll be here often:
             #  - from selenium, we get back unicode - think the paragraph mark;
             #  - from etree.tostring
-            else:
-                # NOTE:  if a grab w/ html, the tags will almost certainly be
-                #  in different order, so w/o grab 3 matches extremely unlikely
-                # logger.error("searchtext: no match |{}| found in {}".format(line, node))
-                line_rep = line[:18]+"..." if len(line) > 18 else line
-                logger.error("searchtext: no match |{}| found in {}".format(line_rep, node))
-                return
+            # NOTE:  if a grab w/ html, the tags will almost certainly be
+            #  in different order, so w/o grab 3 matches extremely unlikely
+            line_rep = line[:18]+"..." if len(line) > 18 else line
+            logger.error("searchtext: no match |{}| found in {}".format(line_rep, node))
+            return
+        (mstart, mend) = spans[i]
         # save these for marking:
         self._search = {'line':line, 'node':node, 'start': start}
         # TODO:  put this on the args list, so args can be saved / restored
-        self._search_anchor = mend
+        self._search_anchor = mend - nstart
         # try to show the enclosing node's full text for context
         # - n: preceding full tag
         # - m: following full end-tag (not necessarily n's closing tag)
-        n = nodestr[:mstart].rfind('>')
-        mark_point = n + 1  # so we can spit out the xpath
-        n = nodestr[:n].rfind('<')
-        m = mend + 1
-        m = nodestr[m:].find('</')+m+1
-        m = nodestr[m:].find('>')+m+1
+        n = nodestr.rfind('>', nstart, mstart)
+        mark_point = n + 1 if n >= 0 else nstart  # so we can spit out the xpath
+        n = max(nodestr.rfind('<', nstart, max(n, nstart)), nstart)
+        m = nodestr.find('</', mend + 1, nend)
+        m = nend if m < 0 else (nodestr.find('>', m, nend) + 1 or nend)
         # show the string, w/ context:
-        self.stdout.write("----- {}[{}:{}]: -----\n{}\n\n".format(node.tag, mstart, mend, nodestr[n:m]))
-        # now, show the xpath leading to this point:
-        # - inject an id;
-        # - find that id;
-        # - get the xpath to it;
-        doc = html.fromstring(nodestr[:mark_point] \
-                               +"<var id=\"__scrape-mark__\"/>"
-                               +nodestr[mark_point:])
-        root = doc.getroottree()  # get the etree version
-        path_node = doc.get_element_by_id("__scrape-mark__", doc)
-        # Stuff to do with the xpath:
-        # - add the '.' relative node, because html trees require it.
-        # - remove the leading 'html' component: that's our relative parent;
-        # - remove the 'var' node we inserted;
-        if len(matches) > 0:
-            self.stdout.write("{} additional matches found following this one.\n".format(len(matches)-1))
-        path = root.getpath(path_node).rsplit('/', 1)[0]
-        head = '/html'
-        if path.startswith(head):
-            path = path[len(head):]
-        path = '.'+path
+        self.stdout.write("----- {}[{}:{}]: -----\n{}\n\n".format(
+            node.tag, mstart - nstart, mend - nstart, nodestr[n:m]))
+        self.stdout.write("{} additional matches found following this one.\n".format(len(spans)-i-1))
+        # now, show the xpath leading to this point (relative to node):
+        # - the element enclosing the match point, from the index;
+        tree = node.getroottree()
+        path = tree.getpath(index.element_at(mark_point))
+        path = '.' + path[len(tree.getpath(node)):]
         self.stdout.write("----- xpath: -----\n{}\n\n".format(path))
         # TODO:  may also want to try to parse out a cssselector out of this context.
         #  Potential strategy:
-        #  - starting from the scrape-mark:
+        #  - starting from the match point:
         #  - work backwards to find the previous 3 (?) nodes containing either id or class
 
         self.path = path
         self.history_append("search "+line)
 
 
+    def text_index(self, node):
+        'the text index of the document node is in;  built once per document'
+        root = node.getroottree().getroot()
+        if self._text_index is None or self._text_index.root is not root:
+            self._text_index = textindex.TextIndex(root)
+        return self._text_index
+
     def do_content(self, line):
         '''content: return text of the specified node, and all its children.
 
@@ -1863,23 +2580,62 @@ class MainCmd(cmd.Cmd):
 
     # PROCESSORS:
 
+    @staticmethod
+    def selector(cmd, arg, over=False):
+        '''
+        the compiled (cached) selector for cmd's arg;
+        over:  for evaluating over the whole node set at once
+               (None, if arg can't be evaluated that way);
+        None for commands which lxml evaluates itself (e.g. getparent).
+        '''
+        if cmd not in ('find', 'findall', 'cssselect'):
+            return None
+        arg = arg.strip()
+        if over:
+            css = cmd == 'cssselect' or selectors.cache.is_css(arg)
+            return selectors.cache.over(arg, css)
+        return selectors.cache.css(arg) if cmd == 'cssselect' else csssel_or_xpath(arg)
+
+    def pushdown_selector(self, cmd, arg):
+        '''
+        for compiling a script plan's push-down extraction:  the browser
+        (kind, selector)s cmd's arg needs;  None if cmd can't be pushed down.
+        '''
+        if cmd in ('find', 'findall', 'cssselect'):
+            arg = arg.strip()
+            if cmd == 'cssselect' or selectors.cache.is_css(arg):
+                sel = ('css', selectors.pushdown_css(arg))
+            else:
+                sel = ('xpath', selectors.pushdown_xpath(arg))
+            return None if sel[1] is None else [sel]
+        return [] if cmd in self.pushdown_safe else None
+
     def getnode(self, cmd, arg):
         ""
         # if node is an array, do cmd for each...
         nodes = self.node
         if not isinstance(nodes, list):
             nodes = [nodes]
-        # TODO:
-        # if arg is not looking like an xpath, then
-        #   assume it's a CSS selector - compile to an xpath.
-        # narg = csssel_or_xpath(arg)
         nnodes = []  # unix-ish naming: n-name => new-name
+        try:
+            selector = self.selector(cmd, arg)
+        except (SyntaxError, etree.XPathError, selectors.SelectorError) as e:
+            logger.error("{}: you need a valid XPATH here.".format(e))
+            return
+        # find:  lxml's own (ElementPath) find, which lxml keeps compiled,
+        #  stops at the first match, where the selector finds them all;
+        #  the selector is for css, and xpath ElementPath can't do (unions, ...)
+        if cmd == 'find' and selectors.elementpath(arg):
+            selector = None
         for node in nodes:
-            action = getattr(node, cmd, None)
+            action = selector or getattr(node, cmd, None)
             self.cmd_trace.append([node, (action, arg)])
             try:
-                nnode = action() if cmd in noargcall else action(arg)
-            except (TypeError, SyntaxError) as e:
+                if selector:
+                    nnode = next((i for i in selector(node) if isinstance(i, etree._Element)), None)
+                else:
+                    nnode = action() if cmd in noargcall else action(arg)
+            except (TypeError, SyntaxError, etree.XPathError) as e:
                 logger.error("{}: you need a valid XPATH here.".format(e))
                 return
             if nnode is None or not isinstance(nnode, html.HtmlElement):
@@ -1899,19 +2655,42 @@ class MainCmd(cmd.Cmd):
         if not isinstance(nodes, list):
             nodes = [nodes]
         nnodes = []  # unix-ish naming: n-name => new-name
-        for node in nodes:
-            action = getattr(node, cmd, None)
-            self.cmd_trace.append([node, (action, arg)])
+        try:
+            selector = self.selector(cmd, arg)
+            over = self.selector(cmd, arg, over=True)
+        except (SyntaxError, etree.XPathError, selectors.SelectorError) as e:
+            logger.error("{}: you need a valid XPATH here.".format(e))
+            return
+        if over is not None:
+            # one evaluation over the whole node set:
+            #  results have no duplicates, and are in document order
+            self.cmd_trace.append([nodes, (over, arg)])
             try:
-                nnode = action() if cmd in noargcall else action(arg)
-            except (TypeError, SyntaxError) as e:
+                nnodes = [i for i in over(nodes[0], nodes=nodes) if isinstance(i, etree._Element)]
+            except (TypeError, etree.XPathError) as e:
                 logger.error("{}: you need a valid XPATH here.".format(e))
                 return
-            if len(nnode) == 0:
-                logger.warning("Nothing found in '{}' with XPATH expression '{}'".format(node.tag, arg))
-                continue
-            nnodes.extend(nnode)
-            logger.info("{} {}: {}".format(cmd, arg, [i.tag for i in nnode]))
+            if len(nnodes) == 0:
+                logger.warning("Nothing found in {} node(s) with XPATH expression '{}'".format(len(nodes), arg))
+            else:
+                logger.info("{} {}: {}".format(cmd, arg, [i.tag for i in nnodes]))
+        else:
+            for node in nodes:
+                action = selector or getattr(node, cmd, None)
+                self.cmd_trace.append([node, (action, arg)])
+                try:
+                    if selector:
+                        nnode = [i for i in selector(node) if isinstance(i, etree._Element)]
+                    else:
+                        nnode = action() if cmd in noargcall else action(arg)
+                except (TypeError, SyntaxError, etree.XPathError) as e:
+                    logger.error("{}: you need a valid XPATH here.".format(e))
+                    return
+                if len(nnode) == 0:
+                    logger.warning("Nothing found in '{}' with XPATH expression '{}'".format(node.tag, arg))
+                    continue
+                nnodes.extend(nnode)
+                logger.info("{} {}: {}".format(cmd, arg, [i.tag for i in nnode]))
         if len(nnodes) > 0:  # don't clobber node if we didn't get anything!
             self.node = nnodes
         self.history_append(cmd + " " + arg)
@@ -1961,27 +2740,17 @@ class MainCmd(cmd.Cmd):
             return
         '''
         nodes = self.node
-        results = []
         if not isinstance(nodes, list):
             nodes = [nodes]
-        for node in nodes:
-            action = getattr(node, cmd, None)
-            if arg in action:
-                # delegate this down to the var assignment:
-                '''
-                self.out[section].append(action[arg])
-                self.cmd_trace.append([node, (action)])
-                logger.info("{}: {} {}: '{}'".format(section, cmd, arg, self.out[section][-1]))
-                '''
-                result = action[arg]
-                logger.info("{} {}: '{}'".format(cmd, arg, result))
-
-                # self.stdout.write(result+'\n')
-                self.cmd_trace.append([node, (action)])
-                results.append(result)
-            else:
-                self.cmd_trace.append([node, (action)])
-                logger.warn("{}: no attribute '{}'".format(node, arg))
+        # the whole node set at once (cmd is 'attrib':  node.get() is node.attrib.get()):
+        values = [node.get(arg) for node in nodes]
+        results = [v for v in values if v is not None]
+        self.cmd_trace.append([nodes, (cmd, arg, results)])
+        if len(results) < len(nodes):
+            for node, v in zip(nodes, values):
+                if v is None:
+                    logger.warn("{}: no attribute '{}'".format(node, arg))
+        logger.info("{} {}: {}".format(cmd, arg, results))
         self.history_append(cmd + " " + arg)
         return results
 
@@ -1998,21 +2767,17 @@ class MainCmd(cmd.Cmd):
             return
         """
         nodes = self.node
-        results = []
         if not isinstance(nodes, list):
             nodes = [nodes]
-        for node in nodes:
-            # if no text, getattr will return None
-            action = getattr(node, cmd, '')
-            if action is None:
-                # TODO:
-                logger.warn("Node '{}' contains no text;".format(node.tag))
-                continue
-            self.cmd_trace.append([node, (cmd, action)])
-            logger.info("{}: '{}'".format(cmd, action.strip()))
-            results.append(action.strip())
-            # if action:
-            #     self.out[section].append(action)
+        # the whole node set at once;  if no text, getattr will return None
+        values = [getattr(node, cmd) for node in nodes]
+        results = [v.strip() for v in values if v is not None]
+        self.cmd_trace.append([nodes, (cmd, results)])
+        if len(results) < len(nodes):
+            for node, v in zip(nodes, values):
+                if v is None:
+                    logger.warn("Node '{}' contains no text;".format(node.tag))
+        logger.info("{}: {}".format(cmd, results))
         self.history_append(cmd + " " + line)
         return results
 
@@ -2322,6 +3087,48 @@ def locate(pattern, root=os.curdir):
             yield os.path.join(path, filename)
 ## end of http://code.activestate.com/recipes/499305/ }}}
 
+## The "scrape profile":
+#  we only use the browser's DOM, so there's no need for it to load
+#  everything else;  Firefox preferences which block each:
+BLOCK_PREFS = {
+    'images': {'permissions.default.image': 2},
+    'media': {'media.autoplay.enabled': False, 'media.autoplay.default': 5,
+              'media.preload.default': 0, 'media.preload.auto': 0},
+    'fonts': {'browser.display.use_document_fonts': 0,
+              'gfx.downloadable_fonts.enabled': False},
+    'css': {'permissions.default.stylesheet': 2},
+}
+# 'scrape' is shorthand for these:
+BLOCK_SCRAPE = ('images', 'media', 'fonts')
+
+def blocking_pac(hosts):
+    '''
+    a proxy auto-config script which sends requests to hosts (or their
+    subdomains) nowhere, so (e.g. third-party tracker) hosts aren't loaded.
+    '''
+    tests = ' || '.join('host == "{0}" || dnsDomainIs(host, ".{0}")'.format(h) for h in hosts)
+    return 'function FindProxyForURL(url, host) {{ return ({}) ? "PROXY 127.0.0.1:9" : "DIRECT"; }}' \
+        .format(tests)
+
+def parse_blocking(words):
+    '''
+    from blocking words ('images', 'css', 'scrape', 'none', 'hosts=a.com,b.com'...),
+    return (resources, hosts) to block;  raises ValueError on unknown words.
+    '''
+    blocking, hosts = set(), []
+    for word in words:
+        if word.startswith('hosts='):
+            hosts.extend(h for h in word[len('hosts='):].split(',') if h)
+        elif word == 'scrape':
+            blocking.update(BLOCK_SCRAPE)
+        elif word == 'none':
+            blocking, hosts = set(), []
+        elif word in BLOCK_PREFS:
+            blocking.add(word)
+        else:
+            raise ValueError(word)
+    return blocking, hosts
+
 ## NOTE:
 #   chromedriver_mac_23.0.1240.0   fails to open jama article URLs;
 #   Going forward, only supporting Firefox driver...
@@ -2331,9 +3138,35 @@ use_browser = "Firefox"
 # open browser control channels:
 # - once open, will return same browswer window channel
 # - only two channels opened per session.
+# - batch workers checkout() browsers from a pool of pool_size more,
+#   so pages can be rendered concurrently.
 class Driver(object):
     _browser = None
     _viewer = None
+    # the browser pool:
+    pool_size = 1
+    _pool = deque()     # idle pooled browsers
+    _pooled = []        # all the pooled browsers started
+    _starting = 0       # pooled browsers being started
+    _pool_cond = threading.Condition()
+    # a thread's checked out browser is its .browser:
+    _local = threading.local()
+    # in batch runs, browsers slow down as they age:  restart one after
+    #  recycle_pages pages, or once its processes' resident memory passes
+    #  recycle_rss bytes (checked every RSS_CHECK pages);  0 means never.
+    recycle_pages = 500
+    recycle_rss = 2048 * 2**20
+    RSS_CHECK = 10
+    _served = {}        # id(browser): pages served
+    # resources (see BLOCK_PREFS) and hosts browsers shouldn't load:
+    blocking = frozenset()
+    blocked_hosts = ()
+    # 'normal' waits for the page's load event; 'eager' for DOMContentLoaded;
+    #  'none' returns right away ('wait' for what a script needs):
+    page_load = 'normal'
+    PAGE_LOADS = ('normal', 'eager', 'none')
+    _profile_gen = 0    # bumped on each change of blocking or page_load
+    _browser_gen = {}   # id(browser): the _profile_gen it started with
     # This is so selenium can pull the user's default
     #  Firefox profile for this set of sessions:
     _ff_profile = None  # a webdriver profile
@@ -2341,13 +3174,151 @@ class Driver(object):
     # Don't have to worry about profiles w/ Chrome:
     _chrome_profile = None
 
+    def _new_browser(self):
+        import_selenium()
+        gen = Driver._profile_gen
+        if use_browser == "Chrome":
+            caps = webdriver.DesiredCapabilities.CHROME.copy()
+            caps['pageLoadStrategy'] = Driver.page_load
+            browser = webdriver.Chrome(desired_capabilities=caps)
+        else:
+            caps = webdriver.DesiredCapabilities.FIREFOX.copy()
+            caps['pageLoadStrategy'] = Driver.page_load
+            browser = webdriver.Firefox(Driver._getprofile(self), capabilities=caps)
+        Driver._browser_gen[id(browser)] = gen
+        return browser
+
     def getbrowser(self):
+        checked_out = getattr(Driver._local, 'browser', None)
+        if checked_out is not None:
+            return checked_out
         if not Driver._browser:
-            Driver._browser = webdriver.Chrome() if use_browser == "Chrome" \
-                else webdriver.Firefox(Driver._getprofile(self))
+            Driver._browser = self._new_browser()
         return Driver._browser
+
+    def page_browser(self):
+        '''
+        the browser, to load a new page in:  the (unpooled) browser is
+        restarted first if it's worn out (pooled ones are, at checkin());
+        never on a plain .browser, which would lose the page it has.
+        '''
+        if getattr(Driver._local, 'browser', None) is None and Driver._browser:
+            why = self._worn_out(Driver._browser)
+            if why:
+                self._retire(Driver._browser, why)
+                Driver._browser = None
+        return self.getbrowser()
+
+    @staticmethod
+    def _pid(browser):
+        'the pid of the process selenium started for browser (if we can find it)'
+        for launcher in ('service', 'binary'):
+            proc = getattr(getattr(browser, launcher, None), 'process', None)
+            if proc is not None:
+                return proc.pid
+        return None
+
+    def served(self, browser):
+        'count a page loaded by browser (for recycling)'
+        with Driver._pool_cond:
+            Driver._served[id(browser)] = Driver._served.get(id(browser), 0) + 1
+
+    def _worn_out(self, browser):
+        'the reason browser should be recycled, or None'
+        if Driver._browser_gen.get(id(browser), Driver._profile_gen) != Driver._profile_gen:
+            return "resource blocking or page load strategy changed"
+        n = Driver._served.get(id(browser), 0)
+        if BATCH and Driver.recycle_pages and n >= Driver.recycle_pages:
+            return "served {} pages".format(n)
+        if BATCH and Driver.recycle_rss and n and n % Driver.RSS_CHECK == 0:
+            rss = procmem.rss(self._pid(browser))
+            if rss and rss > Driver.recycle_rss:
+                return "using {}MB".format(rss // 2**20)
+        return None
+
+    def _retire(self, browser, why):
+        # a new browser will get the same profile (_getprofile() keeps it)
+        logger.info("restarting browser ({})".format(why))
+        with Driver._pool_cond:
+            Driver._served.pop(id(browser), None)
+            Driver._browser_gen.pop(id(browser), None)
+        try:
+            browser.quit()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warn("closing browser: {}".format(e))
+
+    def _start_pooled(self):
+        'start a pooled browser; the caller has counted it in _starting'
+        browser = None
+        try:
+            browser = self._new_browser()
+        finally:
+            with Driver._pool_cond:
+                Driver._starting -= 1
+                if browser is not None:
+                    Driver._pooled.append(browser)
+                Driver._pool_cond.notify_all()
+        return browser
+
+    def checkout(self):
+        '''
+        take a browser from the pool (starting one, if the pool isn't full yet);
+        it's this thread's browser until checkin().
+        '''
+        cond = Driver._pool_cond
+        with cond:
+            while not Driver._pool \
+              and len(Driver._pooled) + Driver._starting >= Driver.pool_size:
+                cond.wait()
+            if Driver._pool:
+                browser = Driver._pool.popleft()
+            else:
+                browser = None
+                Driver._starting += 1
+        if browser is None:
+            browser = self._start_pooled()
+        Driver._local.browser = browser
+        return browser
+
+    def checkin(self, browser=None):
+        'return a checked out browser to the pool'
+        if browser is None:
+            browser = getattr(Driver._local, 'browser', None)
+            Driver._local.browser = None
+        if browser is None:
+            return
+        why = self._worn_out(browser)
+        with Driver._pool_cond:
+            if why:   # the next checkout() will start a replacement
+                Driver._pooled.remove(browser)
+            else:
+                Driver._pool.append(browser)
+            Driver._pool_cond.notify_all()
+        if why:
+            self._retire(browser, why)
+
+    def prestart(self):
+        '''
+        start the rest of the pool's browsers in the background,
+        so their startup overlaps with the first fetches.
+        '''
+        def start():
+            try:
+                browser = self._start_pooled()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Unable to start a browser: {}".format(e))
+                return
+            self.checkin(browser)
+        with Driver._pool_cond:
+            n = Driver.pool_size - len(Driver._pooled) - Driver._starting
+            Driver._starting += max(n, 0)
+        for _ in range(n):
+            t = threading.Thread(target=start)
+            t.daemon = True
+            t.start()
     def getviewer(self):
         if not Driver._viewer:
+            import_selenium()
             Driver._viewer = webdriver.Chrome() if use_browser == "Chrome" \
                 else webdriver.Firefox(Driver._getprofile(self))
         return Driver._viewer
@@ -2356,8 +3327,14 @@ class Driver(object):
             Driver._browser.close()
         if Driver._viewer:
             Driver._viewer.close()
+        with Driver._pool_cond:
+            pooled, Driver._pooled = Driver._pooled, []
+            Driver._pool.clear()
+        for browser in pooled:
+            browser.quit()
 
     def _getprofile(self):
+        import_selenium()
         # get user's default FF profile if possible
         if Driver._use_user_profile and not Driver._ff_profile:
             import platform
@@ -2398,15 +3375,55 @@ class Driver(object):
                         # if this is the case prevent us from thrashing about in the future:
                         Driver._use_user_profile = False
 
-        # no worries: if still "None", selenium will use default profile
-        return Driver._ff_profile
+        if not (Driver.blocking or Driver.blocked_hosts):
+            # no worries: if still "None", selenium will use default profile
+            return Driver._ff_profile
+
+        # the "scrape profile":  a copy of the profile (or a new one),
+        #  which doesn't load what we won't scrape:
+        profile = webdriver.FirefoxProfile(
+            Driver._ff_profile.profile_dir if Driver._ff_profile else None)
+        for what in Driver.blocking:
+            for pref, value in BLOCK_PREFS[what].items():
+                profile.set_preference(pref, value)
+        if Driver.blocked_hosts:
+            profile.set_preference('network.proxy.type', 2)  # auto-config
+            profile.set_preference('network.proxy.autoconfig_url',
+                                   'data:text/plain,' + quote(blocking_pac(Driver.blocked_hosts)))
+        return profile
+
+    def set_blocking(self, blocking, hosts=()):
+        '''
+        set the resources (of BLOCK_PREFS) and hosts browsers won't load;
+        browsers already running are restarted (before their next page) to apply a change.
+        '''
+        blocking, hosts = frozenset(blocking), tuple(hosts)
+        if (blocking, hosts) != (Driver.blocking, Driver.blocked_hosts):
+            Driver.blocking, Driver.blocked_hosts = blocking, hosts
+            Driver._profile_gen += 1
+
+    def set_page_load(self, strategy):
+        '''
+        set the page load strategy (one of PAGE_LOADS) for browsers;
+        browsers already running are restarted (before their next page) to apply a change.
+        '''
+        if strategy not in Driver.PAGE_LOADS:
+            raise ValueError(strategy)
+        if strategy != Driver.page_load:
+            Driver.page_load = strategy
+            Driver._profile_gen += 1
 
     browser = property(fget=getbrowser)
     viewer = property(fget=getviewer)
 
 #  Allow css selectors or xpath expressions anywhere, exchangeably:
 def csssel_or_xpath(arg):
-    pass
+    '''
+    the compiled selector for arg:  an xpath expression, or
+    (if arg isn't one, but is css, e.g. "div.abstract > p") a css selector;
+    compiled selectors are kept in the process wide selectors.cache.
+    '''
+    return selectors.cache.select(arg.strip())
 
 
 
@@ -2425,8 +3442,69 @@ def csssel_or_xpath(arg):
 
 URL_HEAD = ('about:', 'http://', 'https://', 'file:///')
 URL_TYPO = ('http:', 'htp', 'htpp', 'http', 'file')
+URL_HTTP = ('http://', 'https://')
+
+# every fetch (headless or browser) waits its turn on its host here:
+host_scheduler = politeness.HostScheduler()  # pylint: disable= invalid-name
+
+# headless fetches (open_tree, and any crawling commands) share these:
+# pylint: disable= invalid-name
+http_pool = httppool.HTTPPool(scheduler=host_scheduler)
+http_cache = httpcache.HTTPCache()   # used when enabled ('cache on', or --cache)
+# rendered browser pages, saved (--snapshots) for offline re-runs (--replay):
+dom_snapshots = snapshots.SnapshotStore()
+# every page opened, indexed (--corpus) for 'corpus search':
+corpus_index = corpus.CorpusIndex()
+# tables written outside of batches, to one (-o) output:
+output_files = outputs.OutputManager()
+# pylint: enable= invalid-name
+
+def fetch_page(fn):
+    '''
+    headless fetch of the source at a URL, over the shared keep-alive http_pool;
+    through http_cache, when that's enabled.
+    '''
+    try:
+        if http_cache.enabled:
+            return http_cache.fetch(fn, http_pool)
+        f = http_pool.open(fn)
+        try:
+            page = f.read()
+        finally:
+            f.close()
+    except Exception as e:
+        logger.error("Failed to open {}: {}".format(fn, e))
+        raise
+    return page
+
+def feed_page(fn, until=None, max_bytes=0):
+    '''
+    headless fetch and parse of the page at a URL:  the response is fed to
+    lxml's parser in chunks, as they arrive, so parsing overlaps the download
+    (and the whole page is never held as a string);  returns the root.
+    until:  a (bounded) stream.StreamScript;  stop reading the page once
+            the elements it finds have all been parsed;
+    max_bytes:  stop reading after this many bytes (0:  read it all).
+    '''
+    if until is not None:
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+        matcher = stream.Matcher(until)
+    else:
+        parser = html.HTMLParser()
+        matcher = None
+    try:
+        f = http_pool.open(fn)
+        try:
+            root = stream.feed(f, parser, matcher, until is not None, max_bytes)
+        finally:
+            f.close()
+    except Exception as e:
+        logger.error("Failed to open {}: {}".format(fn, e))
+        raise
+    return root
 
-def open_tree(fn, headless=False):
+def _open_tree(fn, headless=False, extract=None, until=None, max_bytes=0):
     # if fn is a file path, try to read it with html.parse(),
     #  but we'll have missing functionality;
     # if fn is a url, or starts with "file:///...", then use
@@ -2450,11 +3528,14 @@ def open_tree(fn, headless=False):
                 node = None
 
         return node
+
+    def _fetch_tree(name):
+        if http_cache.enabled:   # it has the whole page, already
+            return _parse_page_source(fetch_page(name), name)
+        return feed_page(name, until, max_bytes)
     #-----------
 
     ## TODO:  lots of try/excepts needed here:
-    # open the browser; parse the source
-    browser = Driver().browser
     # DEBUG:
     # logger.warn("fn: {}; BATCH={!s}; isfile={!s}".format(fn, BATCH, isfile))
 
@@ -2466,20 +3547,15 @@ def open_tree(fn, headless=False):
         isfile = os.path.isfile(fn)
         if headless:
             try:
-                node = html.parse(fn).getroot()
-            except IOError as e:   # catch all errors
-                opener = build_opener()
-                # may not need this, but we'll set it anyway:
-                opener.addheaders = [('User-agent', 'Mozilla/5.0')]
-                try:
-                    f = opener.open(fn)
-                    page = f.read()
-                except Exception as e:
-                    logger.error("Failed to open {}: {}".format(fn, e.message))
-                    raise
-                finally:
-                    f.close()
-                node = _parse_page_source(page, fn)
+                if fn.startswith(URL_HTTP):
+                    node = _fetch_tree(fn)
+                else:
+                    try:
+                        node = html.parse(fn).getroot()
+                    except IOError:   # not a local file; try fetching it
+                        node = _fetch_tree(fn)
+            except IOError:  # already reported
+                raise
             except:  # catch all
                 e = sys.exc_info()
                 logger.error("Unexpected error {}: {}".format(e[0], e[1]))
@@ -2501,14 +3577,81 @@ def open_tree(fn, headless=False):
                 msg = "Invalid URI: {} (protocol missing); adding 'http://'".format(fn)
                 logger.warn(msg)
                 fn = 'http://'+fn
+        if dom_snapshots.replay:   # no browser: parse what it rendered last time
+            page = dom_snapshots.latest(fn)
+            if page is None:
+                logger.error("No snapshot of {} to replay.".format(fn))
+                return None
+            return _parse_page_source(page, fn)
+        # open the browser; parse the source
         # only if we're dealing with a URI, do we get it;
         # - otherwise we get the current_url in the current browser.
-        browser.get(fn)  # load URI into browser
-
-    # else:  no filename given, use current browser url:
-    page = browser.page_source
+        browser = Driver().page_browser()
+        ticket = host_scheduler.acquire(fn)
+        try:
+            browser.get(fn)  # load URI into browser
+        except Exception:
+            host_scheduler.release(ticket, error=True)
+            raise
+        host_scheduler.release(ticket)
+        Driver().served(browser)
+        url = fn
+    elif dom_snapshots.replay:
+        logger.warn("Replaying snapshots: there is no browser page to open.")
+        return None
+    else:  # no filename given, use current browser url:
+        browser = Driver().browser
+        url = browser.current_url
+
+    # push-down extraction (not when recording: snapshots are of whole pages)
+    page = push_down(browser, extract) if extract and not dom_snapshots.recording else None
+    if page is None:
+        page = browser.page_source
+    if dom_snapshots.recording:
+        dom_snapshots.save(url, page)
     return _parse_page_source(page, browser.current_url)
 
+def stream_page(fn):
+    '''
+    for streaming runs:  what to parse fn from as it arrives - a local file
+    (name), or a headless fetch's response (read whole, if http_cache is enabled).
+    '''
+    if not fn.startswith(URL_HTTP):
+        return fn
+    if http_cache.enabled:
+        return BytesIO(fetch_page(fn))
+    return http_pool.open(fn)
+
+def push_down(browser, extract):
+    '''
+    the browser's page, reduced (in the browser) to the elements matched by
+    extract's (kind, selector)s, and their ancestors;  None if it can't be.
+    '''
+    try:
+        return browser.execute_script(JS_EXTRACT, [list(i) for i in extract])
+    except Exception as e:  # pylint: disable= broad-except
+        logger.warn("push-down extraction failed ({}); using the whole page.".format(e))
+        return None
+
+def open_tree(fn, headless=False, extract=None, until=None, max_bytes=0):
+    '''
+    the root of the document fn (a file or URL;  if none, the browser's
+    current page);  when corpus_index is enabled, the document is indexed.
+    extract:  selectors for push-down extraction from a browser page.
+    until, max_bytes:  where a headless fetch may stop reading (see feed_page).
+    '''
+    node = _open_tree(fn, headless, extract, until, max_bytes)
+    if corpus_index.enabled and node is not None:
+        if not fn:
+            url = Driver().browser.current_url
+        else:
+            url = os.path.abspath(fn) if os.path.isfile(fn) else fn
+        try:
+            corpus_index.add(url, node)
+        except Exception as e:  # pylint: disable= broad-except
+            logger.warn("corpus: couldn't index {}: {}".format(url, e))
+    return node
+
 # TODO:
 #  - have a look at how cmd code (parse) handles this,
 #   - or try map
@@ -2536,19 +3679,6 @@ def must_open(f, c='r'):
     return fp
 
 
-def roll_name(f):
-    n = 0
-    nf = f
-    sf = os.path.splitext(f)
-    while os.path.exists(nf):
-        n += 1
-        if n > 99:
-            logger.error('Unable to open {} - too many files by that name!'.format(f))
-            # exit(2)
-            raise IOError
-        nf = sf[0] + "-{:d}".format(n) + sf[1]
-    return nf
-
 ###
 
 
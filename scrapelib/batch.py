@@ -0,0 +1,74 @@
+##
+# batch.py - run a scrape script over many inputs at once
+#
+#  Each worker gets its own MainCmd (its own vars, tables, node),
+#  and hands back the tables each input wrote;  results are handed on
+#  (to be written) in input order, regardless of the order they finish in.
+
+import threading
+
+
+def run_threads(sources, script, make_worker, jobs, merge):
+    '''
+    run script over each of sources, on a pool of jobs threads;
+    make_worker() returns a fresh MainCmd for each thread;
+    merge(source, written) is called in input order with the tables
+    each source wrote.
+    '''
+    from multiprocessing.pool import ThreadPool
+
+    local = threading.local()
+
+    def work(source):
+        if getattr(local, 'scrape', None) is None:
+            local.scrape = make_worker()
+        return source, local.scrape.run_source(source, script)
+
+    pool = ThreadPool(jobs)
+    try:
+        for source, written in pool.imap(work, sources):
+            merge(source, written)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# per-process worker state, set up by _init_process() in each pool process:
+_worker = None
+_script = None
+
+
+def _init_process(make_worker, script):
+    'pool initializer: one MainCmd per worker process'
+    global _worker, _script  # pylint: disable=global-statement
+    _worker = make_worker()
+    _script = script
+
+
+def _process_source(source):
+    return source, _worker.run_source(source, _script)
+
+
+def run_processes(sources, script, make_worker, processes, merge):
+    '''
+    as run_threads(), but shard sources across a pool of worker processes,
+    so parsing and extraction use all the cores;
+    call this after imports and plugins are loaded:  workers are forked,
+    and share the warm modules copy-on-write.
+    Each worker's tables stream back, and are merged in input order.
+    '''
+    from multiprocessing import Pool
+
+    # small chunks keep results streaming back, without a round trip per input:
+    chunksize = max(1, min(16, len(sources) // (processes * 4)))
+    pool = Pool(processes, initializer=_init_process,
+                initargs=(make_worker, script))
+    try:
+        for source, written in pool.imap(_process_source, sources, chunksize):
+            merge(source, written)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
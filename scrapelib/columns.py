@@ -0,0 +1,235 @@
+##
+# columns.py - compact column storage for scrape vars and tables
+#
+#  Vars (svars, slocals, sglobals) were dicts of plain lists:  on a long
+#  batch run a column of a million short strings is a million pointers,
+#  many to copies of the same journal name, or year.  A Column keeps
+#  whole numbers (as scraped, e.g. years, volumes) in an array, other
+#  strings dictionary encoded (an array of codes into the distinct values)
+#  while they repeat enough to be worth it, and anything else in a list;
+#  it reads back as the list it would have been.  Short columns are padded
+#  (for populous output, by their last value) as they're read, not copied;
+#  and when a table is written, with a fill count (see Column.pad), which
+#  is only stored as values if the column is appended to again.
+
+import re
+from array import array
+from itertools import chain, islice, izip, repeat
+
+# whole numbers, written just so (so they read back the same):
+_WHOLE = re.compile(r'^(0|-?[1-9][0-9]{0,8})$')
+
+# kinds of backing:
+EMPTY, WHOLE, CODED, PLAIN = 'empty', 'whole', 'coded', 'plain'
+
+# a dictionary encoded column stays so while it has no more than this many
+#  distinct values, or they're repeated (on average) at least twice:
+CODED_MIN = 256
+
+
+class Column(object):
+    '''
+    A var's values:  a list-like (append, extend, len, iteration, indexing),
+    stored by kind - WHOLE:  str whole numbers, in an array;  CODED:  strings,
+    as codes into their distinct values;  PLAIN:  a list;  followed by
+    _pad copies of _fill (see pad()).
+    '''
+    __slots__ = ('kind', '_data', '_values', '_codes', '_pad', '_fill')
+
+    def __init__(self, values=()):
+        self.kind = EMPTY
+        self._data = None     # WHOLE: array('l');  CODED: array('I') of codes;  PLAIN: list
+        self._values = None   # CODED: the distinct values, by code
+        self._codes = None    # CODED: (type, value): code
+        self._pad = 0         # values of _fill, after _data's
+        self._fill = ''
+        self.extend(values)
+
+    def _to(self, kind):
+        'store the values so far as kind'
+        values = list(self)
+        self.kind = kind
+        self._values = self._codes = None
+        if kind == WHOLE:
+            self._data = array('l')
+        elif kind == CODED:
+            self._data = array('I')
+            self._values = []
+            self._codes = {}
+        else:
+            self._data = []
+        for v in values:
+            self._put(v)
+
+    def _kind_for(self, v):
+        'the kind a column holding v (and its values so far) needs'
+        if self.kind == PLAIN:
+            return PLAIN
+        if self.kind in (EMPTY, WHOLE) and type(v) is str and _WHOLE.match(v):
+            return WHOLE
+        if isinstance(v, basestring):
+            if self.kind != CODED:
+                return CODED
+            if len(self._values) > CODED_MIN and len(self._values) * 2 > len(self._data):
+                return PLAIN   # mostly distinct:  codes are no saving
+            return CODED
+        return PLAIN
+
+    def _put(self, v):
+        if self.kind == WHOLE:
+            self._data.append(int(v))
+        elif self.kind == CODED:
+            key = (type(v), v)
+            code = self._codes.get(key)
+            if code is None:
+                code = self._codes[key] = len(self._values)
+                self._values.append(v)
+            self._data.append(code)
+        else:
+            self._data.append(v)
+
+    def pad(self, n, populous=False):
+        '''
+        pad the column to n values, with '' or (populous) its last value,
+        as a table does when it's written;  the padding is just counted.
+        '''
+        size = len(self)
+        if size >= n:
+            return
+        fill = self[-1] if (populous and size) else ''
+        if self._pad and fill != self._fill:
+            self._unpad()
+        self._fill = fill
+        self._pad += n - size
+
+    def _unpad(self):
+        'store the padding as values (to append after it)'
+        pad, self._pad = self._pad, 0
+        for _ in xrange(pad):
+            self.append(self._fill)
+
+    def append(self, v):
+        if self._pad:
+            self._unpad()
+        kind = self._kind_for(v)
+        if kind != self.kind:
+            self._to(kind)
+        self._put(v)
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+
+    def __len__(self):
+        return (len(self._data) if self._data is not None else 0) + self._pad
+
+    def __iter__(self):
+        if self.kind == WHOLE:
+            values = (str(n) for n in self._data)
+        elif self.kind == CODED:
+            values = (self._values[c] for c in self._data)
+        else:
+            values = iter(self._data or ())
+        return chain(values, repeat(self._fill, self._pad)) if self._pad else values
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        if self._pad:
+            size = len(self)
+            if i < 0:
+                i += size
+            if not 0 <= i < size:
+                raise IndexError('column index out of range')
+            if i >= size - self._pad:
+                return self._fill
+        if self.kind == WHOLE:
+            return str(self._data[i])
+        if self.kind == CODED:
+            return self._values[self._data[i]]
+        if self._data is None:
+            raise IndexError('column index out of range')
+        return self._data[i]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __getstate__(self):
+        return list(self)
+
+    def __setstate__(self, values):
+        self.__init__(values)
+
+    def copy(self):
+        col = Column()
+        col.kind = self.kind
+        col._data = self._data[:] if self._data is not None else None
+        if self.kind == CODED:
+            col._values = list(self._values)
+            col._codes = dict(self._codes)
+        col._pad, col._fill = self._pad, self._fill
+        return col
+
+    def tolist(self):
+        return list(self)
+
+    def cells(self, n, populous=False):
+        '''
+        the column's first n values, padded (if it's shorter) with '',
+        or (populous) its last value:  without copying either.
+        '''
+        size = len(self)
+        if size >= n:
+            return islice(self, n)
+        fill = self[-1] if (populous and size) else ''
+        return chain(self, repeat(fill, n - size))
+
+    def maxsize(self):
+        'the length of the column\'s longest string value'
+        fill = len(self._fill) if self._pad else 0
+        if self.kind == WHOLE:
+            return max(len(str(min(self._data))), len(str(max(self._data))), fill) \
+                if self._data else fill
+        values = self._values if self.kind == CODED else self._data or ()
+        return max([len(v) for v in values if isinstance(v, basestring)] + [fill])
+
+
+class Table(dict):
+    '''
+    Vars, by name:  {name: Column};  a dict, but columns
+    are read out (padded) as rows, and copied, together.
+    '''
+    def copy(self):
+        return Table((k, v.copy()) for k, v in self.items())
+
+    def tolists(self):
+        'the table as a {name: list} dict (e.g. for json, yaml)'
+        return dict((k, list(v)) for k, v in self.items())
+
+    def nrows(self):
+        return max([len(v) for v in self.values()] or [0])
+
+    def pad(self, populous=False):
+        'pad the columns to the longest one\'s length (see Column.pad)'
+        n = self.nrows()
+        for v in self.values():
+            v.pad(n, populous)
+
+    def rows(self, key_order, populous=False):
+        '''
+        the table's rows, of key_order's columns (missing ones: empty), all
+        padded to the longest one's length (see Column.cells).
+        '''
+        n = self.nrows()
+        return izip(*[self[k].cells(n, populous) if k in self else repeat('', n)
+                      for k in key_order])
+
+    def maxsize(self):
+        'the length of the table\'s longest value'
+        return max([v.maxsize() for v in self.values()] or [0])
@@ -0,0 +1,179 @@
+##
+# corpus.py - an on-disk inverted index of the pages scrape has opened
+#
+#  'search' looks within the current document;  when writing a script you
+#  also want to know which of the pages you've opened (and cached, or
+#  snapshotted) contain some text.  Each document open_tree() returns is
+#  indexed (incrementally:  re-opening an unchanged page does nothing) into
+#  a sqlite database:  for each word, the documents it's in, and the xpath
+#  of the element it first appears in, as a hint for where to look.
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger('scrape.py')
+
+_WORD = re.compile(r'\w+', re.U)
+MAX_WORD = 64   # longer "words" (e.g. encoded data) aren't indexed
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY, url TEXT UNIQUE, digest TEXT, indexed REAL);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT, doc INTEGER, path TEXT, PRIMARY KEY (term, doc));
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+'''
+
+
+def words(text):
+    'the (lower case) words of text, as indexed'
+    return [w for w in _WORD.findall(text.lower()) if len(w) <= MAX_WORD]
+
+
+def _relative(path):
+    'an xpath from the document root, as search shows them:  ./body/...'
+    return '.' + path[len('/html'):] if path.startswith('/html') else path
+
+
+def _common(paths):
+    'the deepest xpath enclosing all paths'
+    steps = [p.split('/') for p in paths]
+    common = []
+    for parts in zip(*steps):
+        if any(p != parts[0] for p in parts):
+            break
+        common.append(parts[0])
+    return '/'.join(common) or '.'
+
+
+class CorpusIndex(object):
+    '''
+    A word -> (documents, xpath hint) index of opened pages, kept in
+    directory/corpus.db;  used when enabled.  Safe to share between
+    threads (and processes:  sqlite locks the database for each update).
+    '''
+    def __init__(self, directory='.scrape_corpus'):
+        self.directory = directory
+        self.enabled = False
+        self._local = threading.local()
+
+    @property
+    def path(self):
+        'the index\'s database file'
+        return os.path.join(self.directory, 'corpus.db')
+
+    @property
+    def _db(self):
+        'this thread\'s (and process\') connection'
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            import sqlite3  # deferred: only needed once a corpus is used
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            local.conn = sqlite3.connect(self.path, timeout=60)
+            local.conn.executescript(_SCHEMA)
+            local.pid = os.getpid()
+        return local.conn
+
+    def add(self, url, root):
+        '''
+        index the document (root element) opened from url;
+        replaces url's previous entries if its text has changed.
+        '''
+        tree = root.getroottree()
+        first = {}   # word: path of the element it first appears in
+        digest = hashlib.sha1()
+        for el in root.iter():
+            if not isinstance(el.tag, basestring):   # comments, PIs
+                if el.tail:
+                    self._words(el.tail, el.getparent(), tree, first, digest)
+                continue
+            if el.tag in ('script', 'style'):
+                text = None
+            else:
+                text = el.text
+            if text:
+                self._words(text, el, tree, first, digest)
+            if el.tail and el is not root:
+                self._words(el.tail, el.getparent(), tree, first, digest)
+        digest = digest.hexdigest()
+        db = self._db
+        with db:
+            row = db.execute('SELECT id, digest FROM docs WHERE url = ?', (url,)).fetchone()
+            if row and row[1] == digest:
+                return
+            if row is None:   # (another process may be adding it too)
+                db.execute('INSERT OR IGNORE INTO docs (url) VALUES (?)', (url,))
+                row = db.execute('SELECT id FROM docs WHERE url = ?', (url,)).fetchone()
+            doc = row[0]
+            db.execute('DELETE FROM postings WHERE doc = ?', (doc,))
+            db.execute('UPDATE docs SET digest = ?, indexed = ? WHERE id = ?',
+                       (digest, time.time(), doc))
+            db.executemany('INSERT OR IGNORE INTO postings (term, doc, path) VALUES (?, ?, ?)',
+                           ((w, doc, p) for w, p in first.iteritems()))
+        logger.info("corpus: indexed {} words of {}".format(len(first), url))
+
+    @staticmethod
+    def _words(text, el, tree, first, digest):
+        found = words(text)
+        if not found:
+            return
+        digest.update(' '.join(found).encode('utf-8'))
+        path = None
+        for w in found:
+            if w not in first:
+                if path is None:
+                    path = _relative(tree.getpath(el))
+                first[w] = path
+
+    def search(self, query, limit=None):
+        '''
+        the documents containing every word of query:  a list of
+        (url, xpath hint), the hint enclosing where the words first appear.
+        '''
+        terms = sorted(set(words(query)))
+        if not terms or not os.path.isfile(self.path):
+            return []
+        db = self._db
+        found = None   # doc: [paths]
+        # rarest word first, so the candidate documents shrink fastest
+        counts = [(db.execute('SELECT count(*) FROM postings WHERE term = ?', (t,)).fetchone()[0], t)
+                  for t in terms]
+        for _, term in sorted(counts):
+            rows = db.execute('SELECT doc, path FROM postings WHERE term = ?', (term,))
+            if found is None:
+                found = dict((doc, [path]) for doc, path in rows)
+            else:
+                hits = dict(rows)
+                found = dict((doc, paths + [hits[doc]]) for doc, paths in found.iteritems()
+                             if doc in hits)
+            if not found:
+                return []
+        urls = dict(db.execute('SELECT id, url FROM docs WHERE id IN ({})'.format(
+            ','.join(str(doc) for doc in found))))
+        results = sorted((urls[doc], _common(paths)) for doc, paths in found.iteritems())
+        return results[:limit] if limit else results
+
+    def clear(self):
+        'remove every document from the index'
+        if not os.path.isfile(self.path):
+            return
+        db = self._db
+        with db:
+            db.execute('DELETE FROM postings')
+            db.execute('DELETE FROM docs')
+
+    def stats(self):
+        'whether it\'s on, where, and (if there is one) the index\'s size'
+        if not os.path.isfile(self.path):   # (don't create one, just to say so)
+            return {'enabled': self.enabled, 'directory': self.directory,
+                    'documents': 0, 'words': 0}
+        db = self._db
+        return {'enabled': self.enabled,
+                'directory': self.directory,
+                'documents': db.execute('SELECT count(*) FROM docs').fetchone()[0],
+                'words': db.execute('SELECT count(DISTINCT term) FROM postings').fetchone()[0]}
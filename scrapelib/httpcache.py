@@ -0,0 +1,182 @@
+##
+# httpcache.py - an on-disk cache of headless fetches
+#
+#  Pages are kept under a cache directory, keyed by URL and request headers:
+#  - <key>.body:  the page source, as fetched;
+#  - <key>.meta:  json - url, ETag, Last-Modified, fetch time, size;
+#                 its file mtime records the last use (for LRU eviction).
+#  Fresh entries (younger than ttl) are served without any network I/O;
+#  stale ones are revalidated with a conditional GET.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('scrape.py')
+
+
+class HTTPCache(object):
+    '''
+    A content cache for pages fetched through an httppool.HTTPPool;
+    ttl is in seconds;  the least recently used entries are evicted
+    once the bodies total more than max_bytes.
+    '''
+    def __init__(self, directory='.scrape_cache', ttl=24*60*60, max_bytes=512*1024*1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self._index = None    # key: meta dict;  loaded on first use
+        self._lock = threading.Lock()
+        self.counts = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evicted': 0}
+
+    @staticmethod
+    def key(url, headers=None):
+        'the cache key for url, as requested with headers'
+        text = url + ''.join('\n{}: {}'.format(k.lower(), v)
+                             for k, v in sorted((headers or {}).items()))
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return hashlib.sha1(text).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        index = {}
+        if os.path.isdir(self.directory):
+            for fn in os.listdir(self.directory):
+                if not fn.endswith('.meta'):
+                    continue
+                pth = os.path.join(self.directory, fn)
+                try:
+                    with open(pth) as f:
+                        meta = json.load(f)
+                    meta['used'] = os.path.getmtime(pth)
+                except (IOError, OSError, ValueError) as e:
+                    logger.warn("http cache: skipping unreadable entry {}: {}".format(pth, e))
+                    continue
+                index[fn[:-len('.meta')]] = meta
+        self._index = index
+        return index
+
+    def _write(self, pth, data):
+        'write atomically, so concurrent workers never read a partial file'
+        tmp = '{}.{}.{}.tmp'.format(pth, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, pth)
+
+    def _save_meta(self, key, meta):
+        self._write(self._path(key, '.meta'),
+                    json.dumps({k: v for k, v in meta.items() if k != 'used'}))
+        meta['used'] = time.time()
+
+    def _touch(self, key, meta):
+        try:
+            os.utime(self._path(key, '.meta'), None)
+        except OSError:
+            pass
+        meta['used'] = time.time()
+
+    def _read_body(self, key):
+        try:
+            with open(self._path(key, '.body'), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            logger.warn("http cache: unreadable body for {}: {}".format(key, e))
+            return None
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        for ext in ('.meta', '.body'):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def store(self, key, url, body, etag=None, last_modified=None):
+        with self._lock:
+            index = self._load_index()
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            self._write(self._path(key, '.body'), body)
+            meta = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                    'fetched': time.time(), 'size': len(body)}
+            self._save_meta(key, meta)
+            index[key] = meta
+            self._evict()
+
+    def _evict(self):
+        'drop least recently used entries until we fit in max_bytes'
+        total = sum(m['size'] for m in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, meta in sorted(self._index.items(), key=lambda i: i[1]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= meta['size']
+            self._remove(key)
+            self.counts['evicted'] += 1
+
+    def fetch(self, url, pool, headers=None):
+        '''
+        return the page at url:  from the cache if fresh;  if stale, revalidated
+        with a conditional GET over pool;  otherwise fetched (and stored).
+        '''
+        hdrs = dict(pool.default_headers)
+        hdrs.update(headers or {})
+        key = self.key(url, hdrs)
+        with self._lock:
+            meta = self._load_index().get(key)
+            body = None if meta is None else self._read_body(key)
+            if body is not None and time.time() - meta['fetched'] < self.ttl:
+                self.counts['hits'] += 1
+                self._touch(key, meta)
+                return body
+        conditional = {}
+        if body is not None:
+            if meta.get('etag'):
+                conditional['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                conditional['If-Modified-Since'] = meta['last_modified']
+        response = pool.open(url, dict(headers or {}, **conditional))
+        try:
+            page = response.read()
+            if response.status == 304 and body is not None:
+                with self._lock:
+                    self.counts['revalidated'] += 1
+                    meta['fetched'] = time.time()
+                    self._save_meta(key, meta)
+                return body
+            etag = response.getheader('etag')
+            last_modified = response.getheader('last-modified')
+        finally:
+            response.close()
+        with self._lock:
+            self.counts['misses'] += 1
+        self.store(key, url, page, etag, last_modified)
+        return page
+
+    def clear(self):
+        'remove every cached page'
+        with self._lock:
+            self._load_index()
+            for key in list(self._index.keys()):
+                self._remove(key)
+
+    def stats(self):
+        'a dict of cache settings, size and hit counts'
+        with self._lock:
+            index = self._load_index()
+            stats = {'enabled': self.enabled, 'directory': self.directory,
+                     'ttl': self.ttl, 'max_bytes': self.max_bytes,
+                     'entries': len(index),
+                     'bytes': sum(m['size'] for m in index.values())}
+            stats.update(self.counts)
+        return stats
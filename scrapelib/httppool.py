@@ -0,0 +1,195 @@
+##
+# httppool.py - keep-alive HTTP(S) connections for headless fetches
+#
+#  urllib2 opens (and closes) a new TCP/TLS connection for every URL;
+#  scraping thousands of pages from the same host, the handshakes dominate.
+#  HTTPPool keeps idle connections per (scheme, host, port) and reuses them.
+
+import httplib
+import logging
+import socket
+import threading
+import time
+import urllib
+import urlparse
+from collections import deque
+
+logger = logging.getLogger('scrape.py')
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+# idle connections kept per host (by default):
+MAXSIZE = 4
+
+
+class HTTPError(IOError):
+    'an HTTP error status (>= 400); status is available for the caller'
+    def __init__(self, url, status, reason):
+        IOError.__init__(self, "HTTP Error {}: {} ({})".format(status, reason, url))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class PooledResponse(object):
+    '''
+    A response on a pooled connection;  read() it, then close() it:
+    a fully read response hands its connection back to the pool.
+    '''
+    def __init__(self, pool, key, conn, response, url, ticket=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._ticket = ticket
+        self._responded = time.time()   # (for the scheduler:  latency to the headers)
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def info(self):
+        return self._response.msg
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.release(self._key, self._conn)
+        else:  # unread body, or server is closing: don't reuse
+            self._response.close()
+            self._conn.close()
+        self._conn = None
+        if self._pool.scheduler:
+            retry_after = self.getheader('retry-after', '')
+            self._pool.scheduler.release(self._ticket, self.status,
+                float(retry_after) if retry_after.isdigit() else None, self._responded)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPPool(object):
+    '''
+    A pool of persistent HTTP(S) connections, kept per (scheme, host, port);
+    up to maxsize idle connections are kept for each host.
+    Shared by all headless fetches (and by batch worker threads).
+    If there's a scheduler (politeness.HostScheduler), every request
+    waits for a slot on its host.
+    '''
+    default_headers = {'User-agent': 'Mozilla/5.0'}
+
+    def __init__(self, maxsize=MAXSIZE, timeout=60, scheduler=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self._idle = {}   # (scheme, host, port): deque of idle connections
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0}
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and not urllib.proxy_bypass(host):
+            phost = urlparse.urlsplit(proxy)
+            if scheme == 'https':   # tunnel through the proxy
+                conn = httplib.HTTPSConnection(phost.hostname, phost.port, timeout=self.timeout)
+                conn.set_tunnel(host, port)
+                return conn
+            return httplib.HTTPConnection(phost.hostname, phost.port, timeout=self.timeout)
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self, key, fresh=False):
+        'an idle connection to key if there is one (and not fresh); else a new one'
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle and not fresh:
+                self.stats['reused'] += 1
+                return idle.pop(), True
+            self.stats['connections'] += 1
+        return self._connect(key), False
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        'close all idle connections'
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise IOError("not an http(s) URL: {}".format(url))
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        if scheme == 'http' and urllib.getproxies().get('http') \
+           and not urllib.proxy_bypass(parts.hostname):
+            path = url    # plain http proxies want the absolute URL
+        else:
+            path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        hdrs = dict(self.default_headers)
+        hdrs.update(headers or {})
+
+        # a reused connection may have been dropped by the server while idle;
+        #  in that case, retry (once) on a fresh connection
+        fresh = False
+        ticket = self.scheduler.acquire(url) if self.scheduler else None
+        while True:
+            conn, reused = self.acquire(key, fresh)
+            try:
+                conn.request('GET', path, headers=hdrs)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    fresh = True
+                    continue
+                if self.scheduler:
+                    self.scheduler.release(ticket, error=True)
+                raise
+            with self._lock:
+                self.stats['requests'] += 1
+            return PooledResponse(self, key, conn, response, url, ticket)
+
+    def open(self, url, headers=None):
+        '''
+        GET url, following redirects; returns a PooledResponse;
+        raises HTTPError for status >= 400 (a 304 is returned as is).
+        '''
+        for _ in range(MAX_REDIRECTS):
+            response = self._request(url, headers)
+            location = response.getheader('location')
+            if response.status in REDIRECTS and location:
+                response.read()
+                response.close()
+                url = urlparse.urljoin(url, location)
+                continue
+            if response.status >= 400:
+                response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason)
+            return response
+        raise IOError("too many redirects: {}".format(url))
@@ -0,0 +1,275 @@
+##
+# outputs.py - output files, kept open while a run writes them
+#
+#  Tables used to re-open their output file (and, unless overwriting,
+#  probe for an unused "rolled" name, one os.path.exists() at a time) each
+#  time they were written.  An OutputManager opens each output once, into
+#  a temporary file beside it, and keeps it open (buffered) for the rest
+#  of the run;  no more than max_open at a time (least recently used ones
+#  are closed, and re-opened to append when they're written again:  e.g.
+#  a table partitioned into a file per journal).  close() renames each
+#  into place, so an output never appears half written;  publish() puts
+#  copies of them there as they are so far (e.g. after an interactive write).
+#  Outputs named with a .gz or .xz suffix are compressed as they're written
+#  (and flushed only as they're closed:  each flush ends a compressed block).
+
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+logger = logging.getLogger('scrape.py')
+
+BUFFER = 256 * 1024   # bytes each open output buffers
+
+# outputs get the permissions a newly created file would (not mkstemp's 0600):
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+# file name suffixes, for compressed output:
+COMPRESSION = ('.gz', '.xz')
+
+
+def compression(fn):
+    'fn\'s compression suffix (one of COMPRESSION), or \'\''
+    ext = os.path.splitext(fn)[1]
+    return ext if ext in COMPRESSION else ''
+
+
+def split_name(fn):
+    'fn as (base, suffix):  the suffix with any compression, e.g. (out, .csv.gz)'
+    packed = compression(fn)
+    base, ext = os.path.splitext(fn[:len(fn) - len(packed)])
+    return base, ext + packed
+
+
+def opener(fn, compress=None):
+    '''
+    the function to open file fn with (as open(fn, mode)):  through gzip
+    or xz compression by its suffix (or by compress, if that's given:
+    a COMPRESSION suffix, or '');  IOError if that isn't available.
+    '''
+    compress = compression(fn) if compress is None else compress
+    if compress == '.gz':
+        return gzip.open
+    if compress == '.xz':
+        try:
+            from backports import lzma  # deferred: only needed for .xz output
+        except ImportError:
+            raise IOError("xz compression (of {}) needs the backports.lzma package".format(fn))
+        return lzma.LZMAFile
+    return lambda name, mode: open(name, mode, BUFFER)
+
+
+def open_file(fn, mode='rb', compress=None):
+    '''
+    open file fn, compressed by its suffix (see opener).
+    Appending to a compressed file adds a new stream to it;
+    gzip and xz read those back as one.
+    '''
+    return opener(fn, compress)(fn, mode)
+
+
+def _temp_file(fn):
+    'a new (empty) temporary file beside fn, with a new file\'s permissions'
+    directory, base = os.path.split(fn)
+    fd, temp = tempfile.mkstemp(prefix='.' + base + '.', suffix='.tmp', dir=directory or '.')
+    os.close(fd)
+    os.chmod(temp, 0o666 & ~_UMASK)
+    return temp
+
+
+def _replace(temp, fn):
+    'rename temp to fn, replacing any file there'
+    if os.name == 'nt' and os.path.exists(fn):
+        os.remove(fn)   # (rename won't replace a file there)
+    os.rename(temp, fn)
+
+
+def roll_name(fn, taken=()):
+    '''
+    fn, or (if a file by that name exists, or it's taken) the first of
+    fn-1, fn-2 ... fn-99 (before its suffix, e.g. .csv.gz) which isn't;
+    IOError if none.
+    '''
+    directory = os.path.dirname(fn) or '.'
+    try:
+        existing = set(os.listdir(directory))
+    except OSError:
+        existing = set()
+    base, ext = split_name(fn)
+    name = fn
+    for n in range(100):
+        if n:
+            name = base + "-{:d}".format(n) + ext
+        if os.path.basename(name) not in existing and name not in taken:
+            return name
+    logger.error('Unable to open {} - too many files by that name!'.format(fn))
+    raise IOError
+
+
+class _Output(object):
+    '''
+    an output file:  its name, the temporary file it\'s written as, and that
+    (if open);  finish(f), if any, writes its end (e.g. closing brackets);
+    size:  its bytes:  any it was opened with (to append to), and those
+           written since (counted before they're compressed);
+    placed:  its size when it was last published.
+    '''
+    __slots__ = ('name', 'temp', 'f', 'finish', 'size', 'placed')
+
+    def __init__(self, name, temp, finish=None):
+        self.name = name
+        self.temp = temp
+        self.f = None
+        self.finish = finish
+        self.size = os.path.getsize(temp)
+        self.placed = None
+
+
+class _Counted(object):
+    '''
+    an output\'s open file f, counting the bytes written to it;
+    flush() is passed on only if it isn\'t compressed.
+    '''
+    __slots__ = ('f', 'out', 'compressed')
+
+    def __init__(self, f, out):
+        self.f = f
+        self.out = out
+        self.compressed = bool(compression(out.name))
+
+    def write(self, s):
+        self.out.size += len(s)
+        self.f.write(s)
+
+    def writelines(self, lines):
+        for s in lines:
+            self.write(s)
+
+    def flush(self):
+        if not self.compressed:
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class OutputManager(object):
+    '''
+    Output files by key (e.g. the name asked for):  file(key) is the open
+    file;  close() puts them all in place, and returns their names.
+    roll:  write new outputs to a rolled name (see roll_name), rather than
+           over an existing file.
+    '''
+    def __init__(self, max_open=64, roll=False):
+        self.max_open = max_open
+        self.roll = roll
+        self._outputs = OrderedDict()   # key: _Output, in the order they're opened
+        self._open = OrderedDict()      # keys of those open;  most recently used last
+
+    def __contains__(self, key):
+        return key in self._outputs
+
+    def open(self, key, name, mode='w', finish=None):
+        '''
+        start the output for key, as file name (rolled, first, if roll);
+        mode 'a' appends to what's there already;  returns the open file.
+        finish(f):  called to write the end of the output, at close().
+        '''
+        if key in self._outputs:
+            return self.file(key)
+        opener(name)   # (IOError now, if it can't be written)
+        if self.roll:
+            name = roll_name(name, taken=set(self.names()))
+        temp = _temp_file(name)
+        if mode.startswith('a') and os.path.isfile(name):
+            shutil.copyfile(name, temp)
+        self._outputs[key] = _Output(name, temp, finish)
+        return self.file(key)
+
+    def file(self, key):
+        'the open file for key (re-opened, if it was closed to make room)'
+        out = self._outputs[key]
+        if out.f is None:
+            while len(self._open) >= max(self.max_open, 1):
+                self._close(self._open.popitem(last=False)[0])
+            out.f = _Counted(open_file(out.temp, 'ab', compression(out.name)), out)
+        else:
+            del self._open[key]
+        self._open[key] = True
+        return out.f
+
+    def name(self, key):
+        'the name key\'s output will have'
+        return self._outputs[key].name
+
+    def size(self, key):
+        'bytes written to key\'s output so far (before compression, if it is)'
+        return self._outputs[key].size
+
+    def names(self):
+        'the names of all the outputs'
+        return [out.name for out in self._outputs.values()]
+
+    def _close(self, key):
+        out = self._outputs[key]
+        out.f.close()
+        out.f = None
+
+    def publish(self):
+        '''
+        put a copy of each output written since it was last put in place
+        there, as it is so far (with its end written), and go on writing
+        it;  returns their names.
+        '''
+        names = []
+        for key, out in self._outputs.items():
+            if out.placed == out.size:
+                continue
+            if out.f is not None:   # (a compressed stream is only whole once it's closed)
+                self._close(key)
+                del self._open[key]
+            temp = _temp_file(out.name)
+            try:
+                shutil.copyfile(out.temp, temp)
+                if out.finish is not None:
+                    f = open_file(temp, 'ab', compression(out.name))
+                    try:
+                        out.finish(f)
+                    finally:
+                        f.close()
+                _replace(temp, out.name)
+            except (IOError, OSError) as e:
+                logger.error("Unable to write {}: {}".format(out.name, e))
+                if os.path.exists(temp):
+                    os.remove(temp)
+                continue
+            out.placed = out.size
+            names.append(out.name)
+        return names
+
+    def close(self):
+        'close every output, and move it into place;  returns their names'
+        for key, out in self._outputs.items():
+            if out.finish is not None:
+                out.finish(self.file(key))
+        outputs, self._outputs = self._outputs, OrderedDict()
+        self._open = OrderedDict()
+        names = []
+        for out in outputs.values():
+            if out.f is not None:
+                out.f.close()
+            try:
+                _replace(out.temp, out.name)
+            except OSError as e:
+                logger.error("Unable to write {} (it's in {}): {}".format(out.name, out.temp, e))
+                continue
+            names.append(out.name)
+        return names
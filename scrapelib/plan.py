@@ -0,0 +1,118 @@
+##
+# plan.py - scrape scripts, compiled once and run per document
+#
+#  'load script' used to re-read the script, and re-run precmd()'s
+#  comment / <var> / [table] rewriting on every line, for every document.
+#  A ScriptPlan holds each line already parsed into its command handler
+#  and argument;  plans are cached by path (and mtime, size), so an edited
+#  script is recompiled.  Selectors in the script (find, findall, cssselect)
+#  are compiled then too, into the selector cache;  and, if the script can
+#  be, into the selectors for push-down extraction in a browser.
+
+import os
+import threading
+
+from scrapelib import stream
+
+_cache = {}   # (path, mtime, size, class): ScriptPlan
+_lock = threading.Lock()
+
+# the "handler" for lines with $(shell) substitutions:
+SUBSTITUTE = object()
+
+# commands which set how browsers load pages:  a batch applies them before
+#  its first input is opened (not part way through an input, which would
+#  restart the browser it's been opened in):
+PROFILE = frozenset(['block', 'pageload'])
+
+
+class ScriptPlan(object):
+    '''
+    A compiled script:  a list of (handler, arg, line) steps;  handler is
+    - an unbound do_* method, for arg (line is as precmd() rewrote it);
+    - None, for lines onecmd() sorts out (e.g. reporting unknown commands);
+    - SUBSTITUTE, for a raw line with $(shell) substitutions, which
+      can only be rewritten (by running them) when it's run.
+    '''
+    __slots__ = ('filename', 'steps', 'extract', 'stream', 'profile')
+
+    def __init__(self, filename, steps, extract=None, profile=()):
+        self.filename = filename
+        self.steps = steps
+        # the (handler, arg) steps of PROFILE commands
+        self.profile = profile
+        # the (kind, selector)s for push-down extraction;
+        #  None if the script can't be pushed down
+        self.extract = extract
+        # the script, for streaming runs (stream.StreamScript);
+        #  None if the script can't be run over a stream
+        self.stream = stream.StreamScript.compile(steps)
+
+    @classmethod
+    def compile(cls, filename, cmdproc):
+        'parse the script in filename, for cmdproc\'s class of command processor'
+        klass = cmdproc.__class__
+        warm = getattr(cmdproc, 'selector', None)
+        push = getattr(cmdproc, 'pushdown_selector', None)
+        extract = [] if push else None
+        comment = getattr(cmdproc, 'is_comment', None)
+        steps, profile = [], []
+        with open(filename) as f:
+            for raw in f:
+                m = comment.search(raw) if comment is not None else None
+                if '$(' in (raw[:m.start()] if m is not None else raw):
+                    # shell output is substituted at run time
+                    steps.append((SUBSTITUTE, None, raw))
+                    extract = None
+                    continue
+                line = cmdproc.precmd(raw)
+                # TODO:  decide if you'd rather let this run self.emptyline(),
+                #       or always skip blank lines in "load", regardless...
+                if not line:
+                    continue
+                cmd, arg, line = cmdproc.parseline(line)
+                handler = getattr(klass, 'do_' + cmd, None) if cmd else None
+                steps.append((handler, arg, line))
+                if handler is not None and handler.__name__[len('do_'):] in PROFILE:
+                    profile.append((handler, arg))
+                if handler is not None and warm is not None:
+                    try:   # compile the step's selector now, into the selector cache
+                        warm(handler.__name__[len('do_'):], arg)
+                    except Exception:  # pylint: disable= broad-except
+                        pass   # ...a bad selector is reported when the step runs
+                if handler is not None and extract is not None:
+                    sels = push(handler.__name__[len('do_'):], arg)
+                    extract = None if sels is None else extract + [i for i in sels if i not in extract]
+        return cls(filename, steps, tuple(extract) if extract else None, tuple(profile))
+
+    def run(self, cmdproc, streamed=None):
+        '''
+        run the script\'s steps on cmdproc;
+        streamed:  {step: values} from a streaming run (see stream.py):
+                   those steps are done, and just hand cmdproc their values.
+        '''
+        for i, (handler, arg, line) in enumerate(self.steps):
+            if streamed is not None and i in streamed:
+                cmdproc.streamed(streamed[i], line)
+            elif handler is SUBSTITUTE:
+                line = cmdproc.precmd(line)
+                if line:
+                    cmdproc.onecmd(line)
+            elif handler is None:
+                cmdproc.onecmd(line)
+            else:
+                cmdproc.lastcmd = line
+                handler(cmdproc, arg)
+
+
+def load(filename, cmdproc):
+    'the compiled plan for script filename (compiled on first use, or when it changes)'
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size, cmdproc.__class__)
+    with _lock:
+        script = _cache.get(key)
+    if script is None:
+        script = ScriptPlan.compile(filename, cmdproc)
+        with _lock:
+            _cache[key] = script
+    return script
@@ -0,0 +1,152 @@
+##
+# politeness.py - per-host scheduling of fetches
+#
+#  Every fetch (headless or browser) asks for a slot on its host first:
+#  - a token bucket limits requests/second per host (rate; 0 is unlimited);
+#  - a concurrency limit caps requests in flight per host;  the limit
+#    adapts AIMD-style:  it grows by 1/limit per good response,
+#    and is halved on 429/503 responses, failed requests, or when latency
+#    (to the response's headers:  not the time spent reading, or parsing,
+#    its body) climbs;
+#  - a 429/503 also pauses the host (for Retry-After, if given).
+
+import logging
+import threading
+import time
+import urlparse
+
+logger = logging.getLogger('scrape.py')
+
+THROTTLED = (429, 503)
+
+
+class _Host(object):
+    'scheduling state for one host'
+    def __init__(self, limit):
+        self.tokens = 1.0
+        self.refilled = time.time()
+        self.limit = limit       # current (adaptive) concurrency limit
+        self.inflight = 0
+        self.waiting = 0
+        self.paused_until = 0
+        self.latency = None      # moving average of response latency
+        self.base_latency = None # best latency seen
+        self.since_decrease = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class HostScheduler(object):
+    '''
+    Rate and concurrency limits per host, for polite scraping.
+    acquire(url) blocks until the host has a slot, and returns a ticket;
+    release(ticket, status) gives the slot back, and adapts the host's limits.
+    '''
+    def __init__(self, rate=0, max_inflight=8, backoff=1.0, slow_factor=3.0):
+        self.rate = rate
+        self.max_inflight = max_inflight
+        self.backoff = backoff            # seconds paused on 429/503 w/o Retry-After
+        self.slow_factor = slow_factor    # latency this many times the best is "slow"
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _refill(self, host, now):
+        if self.rate:
+            host.tokens = min(1.0, host.tokens + (now - host.refilled) * self.rate)
+        host.refilled = now
+
+    def acquire(self, url):
+        'wait for a slot on url\'s host;  returns a ticket for release()'
+        name = urlparse.urlsplit(url).hostname
+        if not name:   # local files, about:blank, ... aren't scheduled
+            return None
+        start = time.time()
+        with self._cond:
+            host = self._hosts.get(name)
+            if host is None:
+                host = self._hosts[name] = _Host(min(2.0, self.max_inflight))
+            host.waiting += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(host, now)
+                    if host.paused_until > now:
+                        delay = host.paused_until - now
+                    elif host.inflight >= int(host.limit):
+                        delay = None   # until a release()
+                    elif self.rate and host.tokens < 1:
+                        delay = (1 - host.tokens) / self.rate
+                    else:
+                        break
+                    self._cond.wait(delay)
+                if self.rate:
+                    host.tokens -= 1
+                host.inflight += 1
+            finally:
+                host.waiting -= 1
+            waited = time.time() - start
+            host.requests += 1
+            host.total_wait += waited
+            host.max_wait = max(host.max_wait, waited)
+        return (name, time.time())
+
+    def release(self, ticket, status=None, retry_after=None, responded=None, error=False):
+        '''
+        return a slot;  status is the HTTP status, if known;
+        retry_after (seconds) is from a Retry-After header, if any;
+        responded:  the time the response (its headers) came (else, now);
+        error:  the request failed (e.g. the connection):  there's no response.
+        '''
+        if ticket is None:
+            return
+        name, started = ticket
+        latency = (responded or time.time()) - started
+        with self._cond:
+            host = self._hosts[name]
+            host.inflight -= 1
+            host.since_decrease += 1
+            if status in THROTTLED:
+                host.throttled += 1
+                host.paused_until = time.time() + (retry_after or self.backoff)
+                self._decrease(host)
+                logger.warn("{}: server returned {}; slowing down (limit {:.1f})"
+                            .format(name, status, host.limit))
+            elif error:
+                host.errors += 1
+                # (once per limit's worth of requests:  not for each of a burst)
+                if host.since_decrease >= host.limit:
+                    self._decrease(host)
+            else:
+                host.latency = latency if host.latency is None \
+                    else 0.8 * host.latency + 0.2 * latency
+                if host.base_latency is None or latency < host.base_latency:
+                    host.base_latency = latency
+                if host.latency > self.slow_factor * host.base_latency \
+                   and host.since_decrease >= host.limit:
+                    self._decrease(host)
+                else:
+                    host.limit = min(float(self.max_inflight), host.limit + 1.0 / host.limit)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _decrease(host):
+        host.limit = max(1.0, host.limit / 2)
+        host.since_decrease = 0
+
+    def stats(self):
+        'a dict, per host, of limits, queue depth and wait times'
+        with self._cond:
+            return {name: {
+                'limit': round(h.limit, 2),
+                'inflight': h.inflight,
+                'waiting': h.waiting,
+                'requests': h.requests,
+                'throttled': h.throttled,
+                'errors': h.errors,
+                'latency': None if h.latency is None else round(h.latency, 3),
+                'max_wait': round(h.max_wait, 3),
+                'mean_wait': round(h.total_wait / h.requests, 3) if h.requests else 0.0,
+            } for name, h in self._hosts.items()}
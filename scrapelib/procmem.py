@@ -0,0 +1,61 @@
+##
+# procmem.py - memory use of a process tree (e.g. a browser and its children)
+#
+#  Uses psutil if it's installed;  otherwise reads /proc (Linux).
+
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # pylint: disable= invalid-name
+
+
+def _children():
+    'map of pid: [child pids], from /proc'
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                # the command name (in parens) may have spaces; ppid follows it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _proc_rss(pid):
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+
+
+def rss(pid):
+    '''
+    resident memory (bytes) of process pid and all its descendants;
+    None if that can't be determined.
+    '''
+    if pid is None:
+        return None
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs)
+        except psutil.Error:
+            return None
+    if not os.path.isdir('/proc/{}'.format(pid)):
+        return None
+    children = _children()
+    total = 0
+    todo = [pid]
+    while todo:
+        p = todo.pop()
+        total += _proc_rss(p)
+        todo.extend(children.get(p, []))
+    return total
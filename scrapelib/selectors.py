@@ -0,0 +1,231 @@
+##
+# selectors.py - compiled xpath and css selectors, cached
+#
+#  lxml re-parses a selector string on every call (and cssselect
+#  re-translates css to xpath);  in a long batch the same few selectors
+#  are used over and over, so keep them compiled:  an LRU, shared by the
+#  whole process.
+
+import re
+import threading
+from collections import OrderedDict
+
+from cssselect import SelectorError
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+# a relative location path (not a function call, or a filter expression):
+_RELATIVE = re.compile(r'^(\.|\*|@|[\w-]+\s*::|[\w-]+\s*(\[|/|$)|(text|node|comment|processing-instruction)\s*\()')
+
+
+def _split_union(xpath):
+    'xpath\'s top level | alternatives (not those in brackets, parens or quotes)'
+    parts, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(xpath):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            parts.append(xpath[start:i])
+            start = i + 1
+    parts.append(xpath[start:])
+    return parts
+
+
+def location_path(xpath):
+    'True if xpath is a (union of) location path(s):  what find, findall select by'
+    return all(p.strip().startswith('/') or _RELATIVE.match(p.strip())
+               for p in _split_union(xpath))
+
+
+# xpath which lxml's ElementPath (element.find()) does as xpath would:  a
+#  relative path of names, *, . and .. steps, with [@attr], [tag], [.=""],
+#  [@attr=""], [tag=""], [n] or [last()-n] predicates (strings blanked)
+_EP_STEP = r'(\.\.?|\*|[\w-]+)(\[\s*(@?[\w-]+(\s*=\s*"")?|\.\s*=\s*""|\d+|last\(\)(\s*-\s*\d+)?)\s*\])*'
+_ELEMENTPATH = re.compile(r'^{0}(//?{0})*$'.format(_EP_STEP))
+
+
+def elementpath(xpath):
+    'True if xpath can be done by ElementPath (see _ELEMENTPATH)'
+    return bool(_ELEMENTPATH.match(STRING.sub('""', xpath.strip())))
+
+
+def over_nodes(xpath):
+    '''
+    xpath, rewritten to evaluate over a whole node set (the variable $nodes)
+    in one call:  relative paths p become $nodes/p;  absolute paths stay.
+    The result is the union of xpath over each node: no duplicates,
+    in document order.  None if xpath isn't a (union of) location path(s).
+    '''
+    parts = []
+    for part in _split_union(xpath):
+        part = part.strip()
+        if part.startswith('/'):
+            parts.append(part)
+        elif _RELATIVE.match(part):
+            parts.append('$nodes/' + part)
+        else:
+            return None
+    return ' | '.join(parts)
+
+
+# steps push-down can't follow:  reverse and sideways axes
+_NOT_DOWN = re.compile(r'\.\.|(ancestor|parent|preceding|following)[\w-]*\s*::')
+# predicates push-down can follow:  tests of the step's own attributes
+_ATTR_TEST = re.compile(r'^(\s+|@[\w:-]+|""|contains|starts-with|normalize-space|concat|not|and|or|!?=|[(),])*$')
+# a string literal:
+STRING = re.compile(r'"[^"]*"|\'[^\']*\'')
+# predicates which only test an element's own attributes:  not its text
+#  (no text(), '.', or functions of the context node, as normalize-space()),
+#  nor its position;  so they can be tested as soon as the element starts
+_OWN_ATTR_TEST = re.compile(r'^(\s+|@[\w:-]+|""|normalize-space\(\s*@[\w:-]+\s*\)'
+                            r'|contains|starts-with|concat|not|and|or|!?=|[(),])*$')
+# css which depends on siblings, or on position
+_CSS_NOT_DOWN = re.compile(r'[+~]|:(nth|first|last|only|empty|root)')
+
+
+def predicates(xpath):
+    'the contents of xpath\'s predicates;  None if they nest'
+    preds, depth, start = [], 0, 0
+    for i, c in enumerate(xpath):
+        if c == '[':
+            if depth:
+                return None
+            depth, start = 1, i + 1
+        elif c == ']':
+            depth = 0
+            preds.append(xpath[start:i])
+    return preds
+
+
+def attribute_predicates(step):
+    '''
+    the contents of a location step's predicates, if they only test the
+    element's own attributes (see _OWN_ATTR_TEST);  None if not.
+    '''
+    preds = predicates(STRING.sub('""', step))
+    if preds is None or not all(_OWN_ATTR_TEST.match(p) for p in preds):
+        return None
+    return preds
+
+
+def pushdown_xpath(xpath):
+    '''
+    for push-down extraction (evaluating a script's selectors in the browser,
+    so only the elements they match, and their ancestors, are transferred):
+    an xpath which, from the document root, finds at least what xpath finds
+    from any node, and which will find the same in the reduced page.
+    None if there isn't one (e.g. xpath uses positions, or parent steps).
+    '''
+    parts = []
+    for part in _split_union(xpath):
+        part = part.strip()
+        bare = STRING.sub('""', part)
+        preds = predicates(bare)
+        if _NOT_DOWN.search(bare) or preds is None \
+           or not all(_ATTR_TEST.match(p) for p in preds) \
+           or not (part.startswith('/') or _RELATIVE.match(part)):
+            return None
+        if part.startswith(('/', './/')):
+            parts.append(part)
+        elif part.lstrip('./'):
+            parts.append('.//' + (part[2:] if part.startswith('./') else part))
+        else:
+            return None
+    return ' | '.join(parts)
+
+
+def pushdown_css(css):
+    'css, for push-down extraction (see pushdown_xpath);  None if it can\'t be'
+    return None if _CSS_NOT_DOWN.search(css) else css
+
+
+class SelectorCache(object):
+    '''
+    An LRU of compiled selectors (etree.XPath objects;  css selectors are
+    translated to xpath, as lxml's cssselect() does, once).
+    '''
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._compiled = OrderedDict()   # (kind, expr): compiled selector
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, kind, expr, compiler):
+        key = (kind, expr)
+        with self._lock:
+            compiled = self._compiled.pop(key, None)
+            if compiled is not None:
+                self._compiled[key] = compiled   # most recently used, last
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        # compile outside the lock;  raises etree.XPathSyntaxError,
+        #  or cssselect's SelectorError
+        compiled = compiler(expr)
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.maxsize:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def xpath(self, expr):
+        'a compiled xpath expression'
+        return self._get('xpath', expr, etree.XPath)
+
+    def css(self, expr):
+        'a compiled css selector (with html semantics, as lxml.html\'s cssselect())'
+        return self._get('css', expr, lambda e: CSSSelector(e, translator='html'))
+
+    def is_css(self, expr):
+        '''
+        True if expr is to be taken as a css selector:  it isn't an xpath
+        location path (find, findall take those, as they always have), but
+        is css (e.g. "div > p", "#main", "h1, h2").
+        '''
+        def compiler(e):
+            try:
+                self.xpath(e)
+                if location_path(e):
+                    return 'xpath'
+            except etree.XPathSyntaxError:
+                pass
+            try:
+                self.css(e)
+                return 'css'
+            except (SyntaxError, SelectorError):
+                return 'xpath'   # (neither:  report the xpath's error)
+        return self._get('kind', expr, compiler) == 'css'
+
+    def select(self, expr):
+        'a compiled xpath expression;  or, if expr isn\'t one, css selector'
+        return self.css(expr) if self.is_css(expr) else self.xpath(expr)
+
+    def over(self, expr, css=False):
+        '''
+        a compiled selector for evaluating expr over a node set at once:
+        call it with any node of the document, and nodes=[the node set];
+        None, if expr can't be evaluated that way (then, evaluate per node).
+        '''
+        def compiler(e):
+            xpath = over_nodes(self.css(e).path if css else e)
+            return etree.XPath(xpath) if xpath else False
+        return self._get('over-css' if css else 'over', expr, compiler) or None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'cached': len(self._compiled), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(float(self.hits) / lookups, 3) if lookups else 0.0}
+
+
+# the process wide cache:
+cache = SelectorCache()  # pylint: disable= invalid-name
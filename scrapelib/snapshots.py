@@ -0,0 +1,61 @@
+##
+# snapshots.py - saved, rendered (post-JavaScript) browser pages
+#
+#  A browser open costs seconds per page;  saving what the browser rendered
+#  lets a script be re-run (or a batch re-done) from the snapshots, offline,
+#  at parse speed.  Layout, under the snapshot directory:
+#  - <sha1 of url>/url.txt:               the url the snapshots are of;
+#  - <sha1 of url>/<timestamp>.html:      one snapshot (utf-8) per render.
+
+import hashlib
+import io
+import os
+import time
+
+TIMESTAMP = '%Y%m%dT%H%M%S'
+
+
+class SnapshotStore(object):
+    '''
+    Rendered page sources, keyed by URL and timestamp.
+    recording:  save each page the browser renders;
+    replay:     serve pages from the latest snapshots, without a browser.
+    '''
+    def __init__(self, directory='.scrape_snapshots'):
+        self.directory = directory
+        self.recording = False
+        self.replay = False
+
+    def _dir(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def save(self, url, page):
+        'save a snapshot of url\'s rendered page;  returns its file name'
+        pth = self._dir(url)
+        if not os.path.isdir(pth):
+            os.makedirs(pth)
+            with io.open(os.path.join(pth, 'url.txt'), 'w', encoding='utf-8') as f:
+                f.write(url if isinstance(url, unicode) else url.decode('utf-8'))
+        now = time.time()
+        fn = os.path.join(pth, '{}.{:06d}.html'.format(
+            time.strftime(TIMESTAMP, time.localtime(now)), int(now % 1 * 1e6)))
+        with io.open(fn, 'w', encoding='utf-8') as f:
+            f.write(page if isinstance(page, unicode) else page.decode('utf-8'))
+        return fn
+
+    def timestamps(self, url):
+        'the snapshot file names of url, oldest first'
+        pth = self._dir(url)
+        if not os.path.isdir(pth):
+            return []
+        return sorted(i for i in os.listdir(pth) if i.endswith('.html'))
+
+    def latest(self, url):
+        'the most recent snapshot of url (as unicode), or None'
+        snaps = self.timestamps(url)
+        if not snaps:
+            return None
+        with io.open(os.path.join(self._dir(url), snaps[-1]), encoding='utf-8') as f:
+            return f.read()
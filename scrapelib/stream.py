@@ -0,0 +1,376 @@
+##
+# stream.py - run a script's selectors over a document as it's parsed
+#
+#  open_tree() builds the whole document tree before a script runs;  for
+#  multi-hundred-MB pages (reference lists, registry dumps) that is most of
+#  the memory, and time.  A script which only selects forward, by paths from
+#  the document (find, findall, cssselect, tested on each element's own tag
+#  and attributes), and takes text, content or attributes of what it finds,
+#  can instead run over lxml's iterparse():  elements are matched as they
+#  start, their values taken as they end, and finished subtrees discarded,
+#  so memory stays flat however large the input.  The rest of the script
+#  (vars, tables, ...) then runs as usual, with those values.
+#
+#  A script which only finds (the first match of each of its selections)
+#  is done with a page once those elements have ended:  feed() can stop
+#  reading there (--early), whether streaming, or building the tree.
+
+import re
+
+from lxml import etree
+from lxml.html import defs
+
+from scrapelib import selectors
+
+# commands which don't use the document (by their canonical do_* names):
+NEUTRAL = frozenset([
+    'table', 'set', 'shell', 'csv', 'json', 'yaml',
+    'populous', 'sparse', 'overwrite', 'roll', 'glob', 'noglob',
+    ])
+# ...which declare (or clear) a var;  they keep the current node
+#  (scrape's preserve_node:  scripts reset it with root, or body):
+DECLARE = frozenset(['var', 'local', 'global', 'clear'])
+# ...which select, from the current node(s):
+SELECT = frozenset(['find', 'findall', 'cssselect'])
+# ...and which take values from the selected nodes:
+VALUES = frozenset(['text', 'content', 'attrib'])
+
+# bytes read (and fed to the parser) at a time:
+FEED_CHUNK = 64 * 1024
+
+# how lxml.html.fromstring() tells a whole page from a fragment (by its start):
+_FULL_HTML = re.compile(br'^\s*<(?:html|!doctype)', re.I)
+
+# an element's text content (as lxml.html's text_content()):
+_CONTENT = etree.XPath('string()')
+
+_AXIS = re.compile(r'^(descendant-or-self|descendant|child)::(.*)$')
+_NAME_TEST = re.compile(r'^(\*|[\w-]+)((\[.*\])*)$')
+
+
+def _split_steps(xpath):
+    'xpath\'s location steps (split on / outside brackets and quotes)'
+    steps, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(xpath):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '"\'':
+            quote = c
+        elif c == '[':
+            depth += 1
+        elif c == ']':
+            depth -= 1
+        elif c == '/' and depth == 0:
+            steps.append(xpath[start:i])
+            start = i + 1
+    steps.append(xpath[start:])
+    return steps
+
+
+class _Path(object):
+    '''
+    A forward xpath, as steps matched on an element as it starts:
+    (axis, tag, test) - axis relating the step to the one before
+    ('child', 'desc' or 'self-desc'), tag (or None, for *), and
+    test, a compiled self:: predicate test (or None).
+    absolute:  the first step relates to the document, not the context node.
+    '''
+    __slots__ = ('steps', 'absolute')
+
+    def __init__(self, steps, absolute):
+        self.steps = steps
+        self.absolute = absolute
+
+    @classmethod
+    def compile(cls, xpath):
+        'the _Path for xpath;  None if xpath can\'t be matched as it\'s parsed'
+        if '|' in selectors.STRING.sub('""', xpath):   # unions: not (yet)
+            return None
+        parts = _split_steps(xpath.strip())
+        absolute = parts[0] == '' and len(parts) > 1
+        if absolute:
+            parts = parts[1:]
+        steps, axis = [], 'child'
+        for i, part in enumerate(parts):
+            part = part.strip()
+            if part == '':     # '//':  descendant-or-self::node()/
+                axis = 'desc'
+                continue
+            if part == '.' and i == 0:
+                continue
+            m = _AXIS.match(part)
+            if m:
+                if m.group(1).startswith('descendant'):
+                    axis = 'desc' if axis == 'desc' or m.group(1) == 'descendant' else 'self-desc'
+                part = m.group(2)
+            m = _NAME_TEST.match(part)
+            if not m:
+                return None
+            # (tested as the element starts:  its text isn't parsed yet)
+            if selectors.attribute_predicates(m.group(2)) is None:
+                return None
+            tag = None if m.group(1) == '*' else m.group(1)
+            test = etree.XPath('self::*' + m.group(2)) if m.group(2) else None
+            steps.append((axis, tag, test))
+            axis = 'child'
+        if not steps:
+            return None
+        return cls(steps, absolute)
+
+    def _step(self, el, i, is_context):
+        _, tag, test = self.steps[i]
+        if (tag is not None and el.tag != tag) or (test is not None and not test(el)):
+            return False
+        return self._related(el, i, is_context)
+
+    def _related(self, el, i, is_context):
+        axis = self.steps[i][0]
+        if i:
+            before = lambda a: a is not None and self._step(a, i - 1, is_context)
+        else:
+            before = lambda a: is_context(a)
+        if axis == 'child':
+            return before(el.getparent())
+        if axis == 'self-desc' and before(el):
+            return True
+        for a in el.iterancestors():
+            if before(a):
+                return True
+        return before(None)    # the document
+
+    def matches(self, el, is_context):
+        '''
+        True if el (which has just started:  its ancestors and attributes
+        are there) is selected by the path, from a node for which
+        is_context() is true (None, for the document itself).
+        '''
+        return self._step(el, len(self.steps) - 1, is_context)
+
+
+class _Extraction(object):
+    '''
+    Values a script step takes (cmd, arg:  e.g. attrib href) from the nodes
+    a chain of selections finds:  levels is a list of (_Path, first),
+    first for a find (the first match only);  from the doc, or its body.
+    '''
+    __slots__ = ('step', 'levels', 'body', 'cmd', 'arg')
+
+    def __init__(self, step, levels, body, cmd, arg):
+        self.step = step
+        self.levels = levels
+        self.body = body
+        self.cmd = cmd
+        self.arg = arg
+
+
+class StreamScript(object):
+    '''
+    A script plan's selections and value steps, for a streaming run:
+    run() parses a document, returning {step: values} for the plan to run with;
+    (selection steps' values are None:  they are done).
+    bounded:  the script only finds - it's done with a document once
+    each find's element has ended.
+    '''
+    __slots__ = ('extractions', 'selections', 'bounded')
+
+    def __init__(self, extractions, selections):
+        self.extractions = extractions
+        self.selections = selections
+        self.bounded = all(first for x in extractions for _, first in x.levels)
+
+    @classmethod
+    def compile(cls, steps):
+        '''
+        the StreamScript for a script plan's (handler, arg, line) steps;
+        None if the script can't be run over a stream.
+        '''
+        extractions, selections = [], []
+        levels, body = [], False
+        for i, (handler, arg, _) in enumerate(steps):
+            if handler is None:   # onecmd() reports it
+                continue
+            if not callable(handler):   # $(shell) substitutions
+                return None
+            cmd = handler.__name__[len('do_'):]
+            arg = arg.strip()
+            if cmd in NEUTRAL or cmd in DECLARE:
+                continue
+            elif cmd in ('root', 'body'):
+                levels, body = [], cmd == 'body'
+                selections.append(i)
+            elif cmd in SELECT:
+                first = cmd == 'find'
+                # after a findall, a find would be the first under each node:
+                if first and not all(f for _, f in levels):
+                    return None
+                if cmd == 'cssselect' or selectors.cache.is_css(arg):
+                    try:
+                        arg = selectors.cache.css(arg).path
+                    except (SyntaxError, selectors.SelectorError):
+                        return None
+                path = _Path.compile(arg)
+                if path is None or (path.absolute and levels):
+                    return None
+                levels = levels + [(path, first)]
+                selections.append(i)
+            elif cmd in VALUES and levels:
+                extractions.append(_Extraction(i, levels, body, cmd, arg))
+            else:
+                return None
+        if not extractions:
+            return None
+        return cls(extractions, selections)
+
+    def run(self, source, early=False, max_bytes=0):
+        '''
+        parse source (a file name, or file-like object) as a stream;
+        returns {step: values} (selection steps:  None).
+        early:  stop reading once a bounded script has all its values;
+        max_bytes:  stop reading after this many bytes (0:  read it all).
+        '''
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        matcher = Matcher(self, discard=True)
+        if isinstance(source, basestring):
+            with open(source, 'rb') as f:
+                feed(f, parser, matcher, early, max_bytes)
+        else:
+            feed(source, parser, matcher, early, max_bytes)
+        return matcher.results()
+
+
+class Matcher(object):
+    '''
+    A StreamScript's matching, over one document's parse events (event(),
+    for each);  discard:  clear finished subtrees no value needs, as it goes.
+    '''
+    __slots__ = ('script', 'discard', '_results', '_state', '_root', '_body', '_pending')
+
+    def __init__(self, script, discard=False):
+        self.script = script
+        self.discard = discard
+        self._results = dict((i, None) for i in script.selections)
+        # per extraction:  the open elements matched at each level, and
+        #  whether a find level has had its match;
+        self._state = []
+        for x in script.extractions:
+            self._results[x.step] = []
+            self._state.append(([set() for _ in x.levels], [False] * len(x.levels)))
+        self._root = self._body = None
+        self._pending = {}   # open final-level matches: el: [(values, index, extraction)]
+
+    @staticmethod
+    def _value(el, cmd, arg):
+        'el\'s value for a value command;  None, for none'
+        if cmd == 'attrib':
+            return el.get(arg)
+        if cmd == 'text':
+            return el.text.strip() if el.text is not None else None
+        text = _CONTENT(el)    # content
+        return text.strip() if text else None
+
+    def event(self, event, el):
+        'match the element an (iterparse) start or end event is for'
+        if event == 'start':
+            self._start(el)
+            return
+        # end:  the element is complete
+        for values, index, x in self._pending.pop(el, ()):
+            values[index] = self._value(el, x.cmd, x.arg)
+        for open_, _ in self._state:
+            for level in open_:
+                level.discard(el)
+        if self.discard and not self._pending and el is not self._root and el is not self._body:
+            # done with it:  discard it, and what came before it
+            el.clear()
+            parent = el.getparent()
+            while el.getprevious() is not None:
+                del parent[0]
+
+    def _start(self, el):
+        if self._root is None:
+            self._root = el
+        elif self._body is None and el.tag == 'body' and el.getparent() is self._root:
+            self._body = el
+        for x, (open_, found) in zip(self.script.extractions, self._state):
+            context = self._body if x.body else self._root
+            for k, (path, first) in enumerate(x.levels):
+                if first and found[k]:
+                    continue
+                if k:
+                    is_context = open_[k - 1].__contains__
+                else:
+                    is_context = lambda a, c=context, p=path: (a is c) if not p.absolute else a is None
+                if context is None or not path.matches(el, is_context):
+                    continue
+                found[k] = True
+                open_[k].add(el)
+                if k == len(x.levels) - 1:
+                    values = self._results[x.step]
+                    values.append(None)   # in document order: filled in at the end
+                    self._pending.setdefault(el, []).append((values, len(values) - 1, x))
+
+    @property
+    def satisfied(self):
+        'True once a bounded script has every value it will take'
+        return self.script.bounded and not self._pending \
+            and all(found[-1] for _, found in self._state)
+
+    def results(self):
+        '{step: values} (selection steps:  None)'
+        results = dict(self._results)
+        for x in self.script.extractions:
+            results[x.step] = [v for v in results[x.step] if v is not None]
+        return results
+
+
+def feed(f, parser, matcher=None, early=False, max_bytes=0):
+    '''
+    feed parser (with start, end events, if there's a matcher for them)
+    from the file-like f, chunk by chunk as it's read;  stop reading early,
+    once matcher is satisfied, or after max_bytes (0:  no limit).
+    returns parser.close():  the (perhaps partial) document\'s root
+    (a fragment\'s, as html.fromstring() has it:  see fragment()).
+    '''
+    read = 0
+    head = b''
+    while True:
+        size = FEED_CHUNK if not max_bytes else min(FEED_CHUNK, max_bytes - read)
+        chunk = f.read(size) if size > 0 else b''
+        if not chunk:
+            break
+        if not read:
+            head = chunk
+        read += len(chunk)
+        parser.feed(chunk)
+        if matcher is not None:
+            for event, el in parser.read_events():
+                matcher.event(event, el)
+            if early and matcher.satisfied:
+                break
+    root = parser.close()
+    if matcher is not None:   # (the rest of the document, closed)
+        for event, el in parser.read_events():
+            matcher.event(event, el)
+    return fragment(root, head)
+
+
+def fragment(root, head):
+    '''
+    root, of a page which starts with head, as html.fromstring() returns it:
+    a whole page is its <html>;  a fragment, its single element (or all of
+    them, in a div - or a span, if none are block level).
+    '''
+    if root is None or _FULL_HTML.match(head):
+        return root
+    # (by tag:  find() misses the parser's implied elements, in some pages)
+    tags = dict((el.tag, el) for el in reversed(root))
+    body = tags.get('body')
+    if body is None or 'head' in tags:
+        return root
+    if (len(body) == 1 and not (body.text or '').strip()
+            and not (body[-1].tail or '').strip()):
+        return body[0]
+    blocks = any(el.tag in defs.block_tags for el in body.iter(etree.Element))
+    body.tag = 'div' if blocks else 'span'
+    return body
@@ -0,0 +1,260 @@
+##
+# tablesink.py - write batch tables row by row, as each input finishes
+#
+#  write_table() writes a whole table at once:  in a batch, that meant
+#  holding every input's rows until the end (or, run serially, re-writing
+#  the table so far after each input).  A TableSink takes each input's
+#  tables as they're done (in input order), pads their columns into rows,
+#  and appends those to the table's output (csv;  or by the file's suffix,
+#  json, json lines or yaml;  .gz or .xz compressed) and the console,
+#  flushing per input, or every flush_rows rows:  memory is bounded by one
+#  input's rows, however long the batch.
+#  A table's rows can be partitioned into a file per value of a column.
+
+import csv
+import json
+import logging
+import re
+from collections import OrderedDict
+
+from scrapelib import outputs
+
+logger = logging.getLogger('scrape.py')
+
+ENCODING = 'utf-8'   # the csv module only does bytes
+
+# what can't be in a partition's file name:
+_UNSAFE = re.compile(r'[^\w.-]+', re.U)
+
+
+# formats, by (uncompressed) file suffix;  the default is csv:
+SUFFIXES = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.yml': 'yaml', '.yaml': 'yaml'}
+
+
+def output_format(fn):
+    'the format to write file fn in, by its suffix (.csv, .json, .jsonl, .yml, ...)'
+    ext = outputs.split_name(fn)[1]
+    return SUFFIXES.get(ext[:len(ext) - len(outputs.compression(fn))], 'csv')
+
+
+def output_name(fn):
+    'the output file name fn:  with a .csv suffix, if it hasn\'t a format\'s'
+    ext = outputs.split_name(fn)[1]
+    return fn if ext[:len(ext) - len(outputs.compression(fn))] in SUFFIXES else fn + '.csv'
+
+
+def yaml_dumper():
+    'libyaml\'s (C) dumper, if PyYAML has it;  else its python one'
+    import yaml  # deferred: only needed for output / display
+    return getattr(yaml, 'CDumper', yaml.Dumper)
+
+
+def partition_name(fn, value):
+    'the name of the file for the rows of output fn whose partition column is value'
+    base, ext = outputs.split_name(fn)
+    value = _UNSAFE.sub('_', value).strip('_.') if value else ''
+    return u"{}-{}{}".format(base, value or 'none', ext)
+
+
+class _CSVRows(object):
+    'rows written as csv'
+    @staticmethod
+    def start(f):
+        pass
+
+    @staticmethod
+    def header(f, key_order):
+        csv.writer(f).writerow([k.encode(ENCODING) for k in key_order])
+
+    @staticmethod
+    def rows(f, key_order, rows, count):
+        csv.writer(f).writerows([[c.encode(ENCODING) for c in row] for row in rows])
+
+    @staticmethod
+    def end(f, count):
+        pass
+
+
+class _JSONRows(object):
+    'rows written as json:  a list of {column: value} objects'
+    @staticmethod
+    def start(f):
+        f.write('[')
+
+    @staticmethod
+    def header(f, key_order):
+        pass
+
+    @staticmethod
+    def rows(f, key_order, rows, count):
+        for i, row in enumerate(rows):
+            f.write(',\n' if count + i else '\n')
+            f.write(json.dumps(OrderedDict(zip(key_order, row))))
+
+    @staticmethod
+    def end(f, count):
+        f.write('\n]\n' if count else ']\n')
+
+
+class _JSONLRows(object):
+    'rows written as json lines:  a {column: value} object per line'
+    @staticmethod
+    def start(f):
+        pass
+
+    @staticmethod
+    def header(f, key_order):
+        pass
+
+    @staticmethod
+    def rows(f, key_order, rows, count):
+        f.writelines(json.dumps(OrderedDict(zip(key_order, row))) + '\n' for row in rows)
+
+    @staticmethod
+    def end(f, count):
+        pass
+
+
+class _YAMLRows(object):
+    'rows written as yaml:  a list of {column: value} mappings'
+    @staticmethod
+    def start(f):
+        pass
+
+    @staticmethod
+    def header(f, key_order):
+        pass
+
+    @staticmethod
+    def rows(f, key_order, rows, count):
+        import yaml  # deferred: only needed for output / display
+        if rows:
+            yaml.dump([dict(zip(key_order, row)) for row in rows], f,
+                      Dumper=yaml_dumper(), default_flow_style=False)
+
+    @staticmethod
+    def end(f, count):
+        if not count:
+            f.write('[]\n')
+
+
+_FORMATS = {'csv': _CSVRows, 'json': _JSONRows, 'jsonl': _JSONLRows, 'yaml': _YAMLRows}
+
+
+def row_format(fn):
+    'the rows writer (start, header, rows, end) for output file fn'
+    return _FORMATS[output_format(fn)]
+
+
+class _Output(object):
+    'a table output:  its format, the table last written to it, and its row counts'
+    __slots__ = ('format', 'table', 'count', 'unflushed')
+
+    def __init__(self, fn):
+        self.format = row_format(fn)
+        self.table = None     # the table whose header was written last
+        self.count = 0
+        self.unflushed = 0
+
+
+class TableSink(object):
+    '''
+    Tables written by a batch's inputs, in input order (add()), appended row
+    by row to each table's file (table name + '.csv'), or to single_output
+    (all tables), and to console (unless None);  roll:  write to rolled names
+    (see outputs.roll_name), rather than over existing files.
+    partition:  a column, by whose values rows are split into files
+                (rows without a value go with the input's one before them);
+    max_open:  the most output files open at once;
+    files:  the outputs.OutputManager to write through (roll, max_open
+            are its own), if not one of the sink's own.
+    close() when the batch is done.
+    '''
+    def __init__(self, populous=False, flush_rows=0, maxcellsize=512,
+                 console=None, to_files=True, single_output=None,
+                 roll=False, report=None, partition=None, max_open=64, files=None):
+        self.populous = populous
+        self.flush_rows = flush_rows
+        self.maxcellsize = int(maxcellsize)
+        self.console = console
+        self.to_files = to_files
+        self.single_output = single_output
+        self.report = report
+        self.partition = partition
+        self.files = files if files is not None else outputs.OutputManager(max_open, roll)
+        self._tables = OrderedDict()   # name: [key_order, rows written]
+        self._outputs = {}             # file name: _Output
+        self._console_table = None
+
+    def filename(self, name):
+        'the file table name is written to (before any partitioning)'
+        return output_name(self.single_output) if self.single_output else name + '.csv'
+
+    def add(self, name, table, key_order):
+        'append one input\'s table (a columns.Table) to the named table'
+        if not table:
+            return
+        order, nrows = self._tables.setdefault(name, [[], 0])
+        for k in list(key_order) + [k for k in table if k not in key_order]:
+            if k not in order:
+                if nrows:
+                    logger.warn("table '{}': column '{}' first appears after {} rows; ".format(
+                        name, k, nrows) + "it's past the columns in the header already written.")
+                order.append(k)
+        rows = list(table.rows(order, self.populous))
+        self._tables[name][1] = nrows + len(rows)
+        maxcell = table.maxsize()
+        if maxcell > self.maxcellsize:
+            logger.warn("table '{}': max output item size is {};".format(name, maxcell))
+        if self.console is not None:
+            if self._console_table != name:
+                _CSVRows.header(self.console, order)
+                self._console_table = name
+            _CSVRows.rows(self.console, order, rows, 0)
+            self.console.flush()
+        if not self.to_files:
+            return
+        fn = self.filename(name)
+        if self.partition in order:
+            # an input's rows go with its last partition value so far (its
+            #  first, before there is one):  sparse rows have it only once
+            column = order.index(self.partition)
+            value = next((row[column] for row in rows if row[column]), '')
+            parts = OrderedDict()
+            for row in rows:
+                value = row[column] or value
+                parts.setdefault(value, []).append(row)
+            for value, part in parts.items():
+                self._write(partition_name(fn, value), name, order, part)
+        else:
+            self._write(fn, name, order, rows)
+
+    def _write(self, fn, name, order, rows):
+        'append table name\'s rows to output file fn'
+        out = self._outputs.get(fn)
+        if out is None:
+            out = self._outputs[fn] = _Output(fn)
+            # (a single output is appended to, as write_table() does;  but not
+            #  a json list)
+            append = self.single_output and out.format is not _JSONRows
+            f = self.files.open(fn, fn, 'a' if append else 'w',
+                                finish=lambda f, out=out: out.format.end(f, out.count))
+            out.format.start(f)
+        else:
+            f = self.files.file(fn)
+        if out.table != name:
+            out.format.header(f, order)
+            out.table = name
+        out.format.rows(f, order, rows, out.count)
+        out.count += len(rows)
+        out.unflushed += len(rows)
+        if not self.flush_rows or out.unflushed >= self.flush_rows:
+            f.flush()
+            out.unflushed = 0
+
+    def close(self):
+        'finish the output files, and put them in place'
+        self._outputs = {}
+        for name in self.files.close():
+            if self.report:
+                self.report(name)
@@ -0,0 +1,86 @@
+##
+# textindex.py - a document's markup, with character offsets mapped to elements
+#
+#  'search' used to serialize the current node on every call, then re-parse
+#  it (with a marker element injected) just to find the xpath of a match.
+#  A TextIndex serializes the document once, and records where each
+#  element's markup starts and ends:  the element enclosing an offset is
+#  then a binary search away.  Match spans are kept too, so 'search -next'
+#  doesn't re-run the regular expression.
+
+import re
+from bisect import bisect_right
+
+from lxml import etree
+
+# tags, in lxml's (xml) serialization:  '<' only starts markup there
+#  (it's escaped in text and attribute values), except within comments / PIs.
+_MARKUP = re.compile(r'<(?:(!--.*?-->)|(\?.*?\?>)|(/)[^>]*>|([^\s/>]+)[^>]*?(/?)>)', re.S)
+
+
+class TextIndex(object):
+    '''
+    The serialized markup (text) of the document rooted at root, with
+    the start and end offsets (in text) of every element's markup.
+    '''
+    __slots__ = ('root', 'text', 'starts', 'ends', 'parents', 'elements', '_position', '_matches')
+
+    def __init__(self, root):
+        self.root = root
+        self.text = etree.tostring(root, encoding='unicode', with_tail=False)
+        self.starts = []    # markup start offset of each element, in document order
+        self.ends = []      # ...and end offset
+        self.parents = []   # ...and index of its parent (-1 for the root)
+        self.elements = []
+        self._matches = {}  # (regex, start, end): [(match start, match end), ...]
+        # comments & PIs are markup too;  they are indexed along with elements
+        nodes = root.iter(etree.Element, etree.Comment, etree.ProcessingInstruction)
+        open_ = []
+        for m in _MARKUP.finditer(self.text):
+            comment, pi, closing, tag, empty = m.groups()
+            if closing:
+                self.ends[open_.pop()] = m.end()
+                continue
+            node = next(nodes, None)
+            if node is None or (tag and node.tag != tag) \
+               or (comment and node.tag is not etree.Comment) \
+               or (pi and node.tag is not etree.ProcessingInstruction):
+                raise ValueError("can't index the markup of <{}>: unexpected '{}'"
+                                 .format(root.tag, m.group(0)[:40]))
+            self.starts.append(m.start())
+            self.ends.append(m.end())
+            self.parents.append(open_[-1] if open_ else -1)
+            self.elements.append(node)
+            if tag and not empty:
+                open_.append(len(self.elements) - 1)
+        self._position = dict((e, i) for i, e in enumerate(self.elements))
+
+    def span(self, element):
+        '(start, end) offsets of element\'s markup;  KeyError if it isn\'t indexed'
+        i = self._position[element]
+        return self.starts[i], self.ends[i]
+
+    def element_at(self, offset):
+        'the innermost element whose markup encloses offset (None, if none does)'
+        i = bisect_right(self.starts, offset) - 1
+        while i >= 0 and (self.ends[i] <= offset or not isinstance(self.elements[i].tag, basestring)):
+            i = self.parents[i]
+        return self.elements[i] if i >= 0 else None
+
+    def matches(self, regex, start, end):
+        '''
+        (start, end) spans of the matches of regex in text[start:end];
+        if regex isn't a valid regular expression, or doesn't match,
+        the spans of it as plain text.  Spans are cached.
+        '''
+        key = (regex, start, end)
+        spans = self._matches.get(key)
+        if spans is None:
+            try:
+                spans = [m.span() for m in re.compile(regex, re.M).finditer(self.text, start, end)]
+            except re.error:
+                spans = []
+            if not spans:
+                spans = [m.span() for m in re.compile(re.escape(regex)).finditer(self.text, start, end)]
+            self._matches[key] = spans
+        return spans
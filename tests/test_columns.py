@@ -0,0 +1,100 @@
+##
+# test_columns.py - compact columns read back as the lists they'd have been
+#
+#  run:  python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import scrape
+from scrapelib import columns
+from scrapelib import outputs
+
+
+class TestColumn(unittest.TestCase):
+
+    def test_kinds(self):
+        for values, kind in ((['1999', '2000', '0'], columns.WHOLE),
+                             (['Nature', 'Science', 'Nature'], columns.CODED),
+                             ([u'x', None], columns.PLAIN)):
+            col = columns.Column(values)
+            self.assertEqual(col.kind, kind)
+            self.assertEqual(list(col), values)
+
+    def test_whole_keeps_spelling(self):
+        col = columns.Column(['12', '012', '-3'])
+        self.assertEqual(list(col), ['12', '012', '-3'])
+
+    def test_mostly_distinct_goes_plain(self):
+        values = [str(i) + 'x' for i in range(columns.CODED_MIN * 3)]
+        col = columns.Column(values)
+        self.assertEqual(col.kind, columns.PLAIN)
+        self.assertEqual(list(col), values)
+
+    def test_pad(self):
+        col = columns.Column(['a'])
+        col.pad(3)
+        self.assertEqual((len(col), list(col), col[-1], col[1]), (3, ['a', '', ''], '', ''))
+        col.append('b')
+        self.assertEqual(list(col), ['a', '', '', 'b'])
+
+    def test_pad_populous(self):
+        col = columns.Column(['a'])
+        col.pad(2, populous=True)
+        col.pad(3, populous=True)
+        self.assertEqual(list(col), ['a', 'a', 'a'])
+        self.assertEqual(list(col.copy()), ['a', 'a', 'a'])
+
+    def test_rows(self):
+        table = columns.Table(j=columns.Column(['J1']), u=columns.Column(['/a', '/b']))
+        self.assertEqual(list(table.rows(['j', 'u', 'x'])),
+                         [('J1', '/a', ''), ('', '/b', '')])
+        self.assertEqual(list(table.rows(['j'], populous=True)), [('J1',), ('J1',)])
+
+
+PAGE = '<html><body><h1>{}</h1><a href="/a{}">x</a><a href="/b{}">y</a></body></html>'
+SCRIPT = '[t]\n<j>\nfind .//h1\ntext\n<u>\nroot\nfindall .//a\nattrib href\ntable\n'
+
+
+class TestWrite(unittest.TestCase):
+    'a var redeclared after a table is written goes on the rows after it'
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        for n, journal in ((1, 'J1'), (2, 'J0')):
+            with open('p{}.html'.format(n), 'w') as f:
+                f.write(PAGE.format(journal, n, n))
+        with open('s.scrape', 'w') as f:
+            f.write(SCRIPT)
+        self.batch = scrape.BATCH
+        scrape.BATCH = True
+        self.files = scrape.output_files
+        scrape.output_files = outputs.OutputManager()
+
+    def tearDown(self):
+        scrape.BATCH = self.batch
+        scrape.output_files = self.files
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_redeclared_after_write(self):
+        cmd = scrape.MainCmd()
+        cmd.headless, cmd.overwrite, cmd.maxcellsize = True, True, 512
+        cmd.single_output, cmd.console_out = 'out.csv', True
+        cmd.stderr = open(os.devnull, 'w')
+        for page in ('p1.html', 'p2.html'):
+            cmd.onecmd('open ' + page)
+            cmd.onecmd('load s.scrape')
+        scrape.output_files.close()
+        self.assertEqual(list(cmd.svars['j']), ['J1', '', 'J0', ''])
+        with open('out.csv') as f:
+            rows = f.read().splitlines()
+        self.assertEqual(rows[-2:], ['J0,/a2', ',/b2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
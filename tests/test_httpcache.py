@@ -0,0 +1,137 @@
+##
+# test_httpcache.py - fresh pages from disk;  stale ones revalidated;  LRU eviction
+#
+#  run:  python -m unittest discover tests
+
+import shutil
+import tempfile
+import unittest
+
+from scrapelib import httpcache
+
+
+class Clock(object):
+    'time.time(), stepping a second each time it\'s read'
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class Response(object):
+    def __init__(self, status, body, headers):
+        self.status = status
+        self._body = body
+        self._headers = headers
+
+    def read(self):
+        return self._body
+
+    def getheader(self, name, default=None):
+        return self._headers.get(name, default)
+
+    def close(self):
+        pass
+
+
+class Pool(object):
+    'a stand-in httppool.HTTPPool, serving pages (by url) with an ETag'
+    default_headers = {'User-Agent': 'test'}
+
+    def __init__(self):
+        self.pages = {}        # url: (etag, body)
+        self.requests = []     # (url, headers)
+
+    def open(self, url, headers=None):
+        self.requests.append((url, headers or {}))
+        etag, body = self.pages[url]
+        if (headers or {}).get('If-None-Match') == etag:
+            return Response(304, '', {})
+        return Response(200, body, {'etag': etag})
+
+
+class TestHTTPCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.time = httpcache.time
+        httpcache.time = Clock()
+        self.cache = httpcache.HTTPCache(self.dir, ttl=60)
+        self.pool = Pool()
+        self.pool.pages['http://a/'] = ('"1"', 'page a')
+
+    def tearDown(self):
+        httpcache.time = self.time
+        shutil.rmtree(self.dir)
+
+    def test_fresh(self):
+        self.assertEqual(self.cache.fetch('http://a/', self.pool), 'page a')
+        self.assertEqual(self.cache.fetch('http://a/', self.pool), 'page a')
+        self.assertEqual(len(self.pool.requests), 1)
+        self.assertEqual((self.cache.counts['misses'], self.cache.counts['hits']), (1, 1))
+
+    def test_persists(self):
+        self.cache.fetch('http://a/', self.pool)
+        cache = httpcache.HTTPCache(self.dir, ttl=60)
+        self.assertEqual(cache.fetch('http://a/', self.pool), 'page a')
+        self.assertEqual(len(self.pool.requests), 1)
+
+    def test_stale_not_modified(self):
+        self.cache.ttl = 0
+        self.cache.fetch('http://a/', self.pool)
+        self.assertEqual(self.cache.fetch('http://a/', self.pool), 'page a')
+        self.assertEqual(self.pool.requests[1][1], {'If-None-Match': '"1"'})
+        self.assertEqual(self.cache.counts['revalidated'], 1)
+
+    def test_stale_modified(self):
+        self.cache.ttl = 0
+        self.cache.fetch('http://a/', self.pool)
+        self.pool.pages['http://a/'] = ('"2"', 'page a, again')
+        self.assertEqual(self.cache.fetch('http://a/', self.pool), 'page a, again')
+        self.assertEqual(self.cache.counts['misses'], 2)
+        self.cache.ttl = 60
+        self.assertEqual(self.cache.fetch('http://a/', self.pool), 'page a, again')
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_ttl(self):
+        self.cache.ttl = 5
+        self.cache.fetch('http://a/', self.pool)
+        httpcache.time.now += 10
+        self.cache.fetch('http://a/', self.pool)
+        self.assertEqual(len(self.pool.requests), 2)
+        self.assertEqual(self.cache.counts['revalidated'], 1)
+
+    def test_headers_key(self):
+        self.cache.fetch('http://a/', self.pool)
+        self.cache.fetch('http://a/', self.pool, {'Accept-Language': 'fr'})
+        self.assertEqual(len(self.pool.requests), 2)
+
+    def test_lru_eviction(self):
+        for url in ('http://b/', 'http://c/'):
+            self.pool.pages[url] = ('"1"', 'page ' + url[-2])
+        self.cache.max_bytes = 2 * len('page a')
+        self.cache.fetch('http://a/', self.pool)
+        self.cache.fetch('http://b/', self.pool)
+        self.cache.fetch('http://a/', self.pool)   # (a hit:  b is least recently used)
+        self.cache.fetch('http://c/', self.pool)
+        self.assertEqual(self.cache.counts['evicted'], 1)
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes']), (2, 2 * len('page a')))
+        self.cache.fetch('http://a/', self.pool)
+        self.cache.fetch('http://c/', self.pool)
+        self.assertEqual(len(self.pool.requests), 3)
+        self.cache.fetch('http://b/', self.pool)
+        self.assertEqual(len(self.pool.requests), 4)
+
+    def test_clear(self):
+        self.cache.fetch('http://a/', self.pool)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.cache.fetch('http://a/', self.pool)
+        self.assertEqual(len(self.pool.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+##
+# test_outputs.py - outputs are written aside, and renamed into place at close
+#
+#  run:  python -m unittest discover tests
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapelib import outputs
+
+
+class TestOutputManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = outputs.OutputManager()
+
+    def tearDown(self):
+        self.files.close()
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_rename_at_close(self):
+        name = self.path('out.csv')
+        self.files.open(name, name).write('a,b\r\n')
+        self.files.file(name).flush()
+        self.assertFalse(os.path.exists(name))
+        temps = os.listdir(self.dir)
+        self.assertEqual(len(temps), 1)
+        self.assertTrue(temps[0].startswith('.out.csv.'))
+        self.assertEqual(self.files.close(), [name])
+        self.assertEqual(os.listdir(self.dir), ['out.csv'])
+        with open(name) as f:
+            self.assertEqual(f.read(), 'a,b\r\n')
+
+    def test_append(self):
+        name = self.path('out.csv')
+        with open(name, 'w') as f:
+            f.write('a\r\n')
+        self.files.open(name, name, 'a').write('b\r\n')
+        self.assertEqual(self.files.size(name), 6)
+        with open(name) as f:
+            self.assertEqual(f.read(), 'a\r\n')   # (until it's closed)
+        self.files.close()
+        with open(name) as f:
+            self.assertEqual(f.read(), 'a\r\nb\r\n')
+
+    def test_roll(self):
+        name = self.path('out.csv')
+        open(name, 'w').close()
+        self.files.roll = True
+        self.files.open(name, name).write('x')
+        self.assertEqual(self.files.close(), [self.path('out-1.csv')])
+
+    def test_reopen(self):
+        self.files.max_open = 1
+        names = [self.path('out{}.csv'.format(n)) for n in range(3)]
+        for n in range(2):
+            for name in names:
+                self.files.open(name, name).write(name[-5])
+        self.assertEqual(self.files.close(), names)
+        for name in names:
+            with open(name) as f:
+                self.assertEqual(f.read(), name[-5] * 2)
+
+    def test_finish(self):
+        name = self.path('out.json')
+        self.files.open(name, name, finish=lambda f: f.write(']')).write('[1')
+        self.files.close()
+        with open(name) as f:
+            self.assertEqual(f.read(), '[1]')
+
+    def test_publish(self):
+        name = self.path('out.json')
+        self.files.open(name, name, finish=lambda f: f.write(']')).write('[1')
+        self.assertEqual(self.files.publish(), [name])
+        with open(name) as f:
+            self.assertEqual(f.read(), '[1]')
+        self.assertEqual(self.files.publish(), [])   # (nothing new)
+        self.files.file(name).write(',2')
+        self.files.publish()
+        with open(name) as f:
+            self.assertEqual(f.read(), '[1,2]')
+        self.files.close()
+        with open(name) as f:
+            self.assertEqual(f.read(), '[1,2]')
+
+    def test_publish_compressed(self):
+        name = self.path('out.csv.gz')
+        self.files.open(name, name).write('a\r\n')
+        self.files.publish()
+        with gzip.open(name) as f:
+            self.assertEqual(f.read(), 'a\r\n')
+        self.files.file(name).write('b\r\n')
+        self.files.close()
+        with gzip.open(name) as f:
+            self.assertEqual(f.read(), 'a\r\nb\r\n')
+
+    def test_compressed(self):
+        name = self.path('out.csv.gz')
+        f = self.files.open(name, name)
+        for n in range(100):
+            f.write('row {}\r\n'.format(n))
+            f.flush()   # (not until it's closed)
+        self.assertEqual(self.files.size(name), sum(len('row {}\r\n'.format(n)) for n in range(100)))
+        self.files.close()
+        with gzip.open(name) as f:
+            self.assertEqual(f.readline(), 'row 0\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+##
+# test_politeness.py - per-host limits:  AIMD concurrency, pauses, rate
+#
+#  run:  python -m unittest discover tests
+
+import threading
+import time
+import unittest
+
+from scrapelib import politeness
+
+URL = 'http://example.com/page'
+
+
+class TestHostScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = politeness.HostScheduler(max_inflight=8)
+
+    def limit(self):
+        return self.scheduler._hosts['example.com'].limit
+
+    def fetch(self, status=200, latency=0.01, **kw):
+        ticket = self.scheduler.acquire(URL)
+        self.scheduler.release(ticket, status, responded=ticket[1] + latency, **kw)
+
+    def test_unscheduled(self):
+        self.assertIsNone(self.scheduler.acquire('/tmp/page.html'))
+        self.scheduler.release(None, 200)
+
+    def test_additive_increase(self):
+        self.fetch()
+        self.assertEqual(self.limit(), 2.5)
+        for _ in range(100):
+            self.fetch()
+        self.assertEqual(self.limit(), 8.0)   # (max_inflight)
+
+    def test_throttled(self):
+        for _ in range(100):
+            self.fetch()
+        self.fetch(429, retry_after=0.2)
+        self.assertEqual(self.limit(), 4.0)
+        start = time.time()
+        self.fetch()
+        self.assertGreaterEqual(time.time() - start, 0.1)   # (paused)
+        self.fetch(503)
+        self.assertEqual(self.scheduler.stats()['example.com']['throttled'], 2)
+
+    def test_floor(self):
+        self.scheduler.backoff = 0
+        for _ in range(5):
+            self.fetch(503)
+        self.assertEqual(self.limit(), 1.0)
+
+    def test_errors(self):
+        for _ in range(100):
+            self.fetch()
+        self.fetch(None, error=True)
+        self.fetch(None, error=True)   # (a burst:  halved once)
+        self.assertEqual(self.limit(), 4.0)
+        for _ in range(3):
+            self.fetch(None, error=True)
+        self.assertEqual(self.limit(), 2.0)
+        self.assertEqual(self.scheduler.stats()['example.com']['errors'], 5)
+
+    def test_slow(self):
+        for _ in range(100):
+            self.fetch()
+        for _ in range(10):
+            self.fetch(latency=1.0)
+        self.assertLess(self.limit(), 8.0)
+
+    def test_concurrency(self):
+        first, second = self.scheduler.acquire(URL), self.scheduler.acquire(URL)
+        third = []
+        t = threading.Thread(target=lambda: third.append(self.scheduler.acquire(URL)))
+        t.start()
+        t.join(0.1)
+        self.assertEqual(third, [])   # (limit 2:  waiting for a slot)
+        self.scheduler.release(first, 200)
+        t.join(5)
+        self.assertEqual(len(third), 1)
+        self.scheduler.release(second, 200)
+        self.scheduler.release(third[0], 200)
+        self.assertEqual(self.scheduler.stats()['example.com']['inflight'], 0)
+
+    def test_rate(self):
+        self.scheduler.rate = 20
+        start = time.time()
+        for _ in range(5):
+            self.fetch()
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+##
+# test_selectors.py - find / findall take xpath (positions, unions) first
+#
+#  run:  python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import scrape
+from scrapelib import selectors
+
+PAGE = '''<html><body>
+<div><p>First para</p><p>Second para</p></div>
+<table><tr><td>r1</td></tr><tr><td>r2</td></tr></table>
+<table><tr><td>s1</td></tr><tr><td>s2</td></tr></table>
+<h1>Head 1</h1><h2>Head 2</h2>
+</body></html>
+'''
+
+
+class TestFind(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.page = os.path.join(self.dir, 'page.html')
+        with open(self.page, 'w') as f:
+            f.write(PAGE)
+        self.batch = scrape.BATCH
+        scrape.BATCH = True   # (as a batch run:  no interactive history)
+        self.cmd = scrape.MainCmd()
+        self.cmd.headless = True
+        self.cmd.onecmd('open ' + self.page)
+
+    def tearDown(self):
+        scrape.BATCH = self.batch
+        shutil.rmtree(self.dir)
+
+    def scraped(self, *lines):
+        'the values the script lines put in var v'
+        for line in ('var v',) + lines:
+            self.cmd.onecmd(self.cmd.precmd(line))
+        return list(self.cmd.svars['v'])
+
+    def test_find_position(self):
+        self.assertEqual(self.scraped('find .//div', 'find p[2]', 'text'), ['Second para'])
+
+    def test_findall_position(self):
+        self.assertEqual(self.scraped('findall .//table', 'findall tr[1]', 'content'), ['r1', 's1'])
+
+    def test_findall_union(self):
+        self.assertEqual(self.scraped('findall .//h1 | .//h2', 'text'), ['Head 1', 'Head 2'])
+
+    def test_findall_css(self):
+        self.assertEqual(self.scraped('findall div > p', 'text'), ['First para', 'Second para'])
+
+
+    def test_find_not_elementpath(self):
+        self.assertEqual(self.scraped('find .//h3 | .//h2', 'text'), ['Head 2'])
+
+
+class TestElementPath(unittest.TestCase):
+
+    def test_elementpath(self):
+        for expr in ('.//td', 'p[2]', '*[1]', 'a[@href]', 'a[@href="x|y"]', 'td[last()-1]', '..'):
+            self.assertTrue(selectors.elementpath(expr), expr)
+
+    def test_not_elementpath(self):
+        for expr in ('h1 | h2', '(.//td)[1]', '//td', 'text()', 'p[position()>1]', 'div > p'):
+            self.assertFalse(selectors.elementpath(expr), expr)
+
+
+class TestIsCss(unittest.TestCase):
+
+    def test_xpath(self):
+        for expr in ('p[2]', 'tr[1]', '*[1]', 'a[href]', 'h1 | h2', './/div'):
+            self.assertFalse(selectors.cache.is_css(expr), expr)
+
+    def test_css(self):
+        for expr in ('div > p', '#main', 'h1, h2', 'div p', 'div.abstract'):
+            self.assertTrue(selectors.cache.is_css(expr), expr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+##
+# test_stream.py - pages fed to the parser as they're read;  --stream runs
+#
+#  run:  python -m unittest discover tests
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from lxml import etree, html
+
+import scrape
+from scrapelib import plan, stream
+
+PAGE = '''<html><head><title>Doc {n}</title>
+<meta name="citation_journal" content="J{n}"/></head>
+<body><div class="article"><h1 id="t">Title {n}</h1>
+<ul class="refs"><li>ref a{n}</li><li>ref b{n}</li><li><b>ref</b> c{n}</li></ul>
+<p>Author Affiliations: Univ {n}</p></div></body></html>
+'''
+
+SCRIPT = '''[articles]
+<title>
+find .//h1
+text
+<journal>
+root
+find .//meta[@name="citation_journal"]
+attrib content
+<refs>
+root
+findall .//li
+text
+table
+'''
+
+
+def fed(page):
+    return stream.feed(io.BytesIO(page), html.HTMLParser())
+
+
+class TestFeed(unittest.TestCase):
+
+    def assertFromstring(self, page):
+        root, expected = fed(page), html.fromstring(page)
+        self.assertEqual(root.tag, expected.tag, page)
+        self.assertEqual(etree.tostring(root), etree.tostring(expected), page)
+
+    def test_document(self):
+        for page in (b'<html><body><p>x</p></body></html>',
+                     b'<!DOCTYPE html><p>x</p>',
+                     b'<title>t</title><p>x</p>'):
+            self.assertEqual(fed(page).tag, 'html')
+            self.assertFromstring(page)
+
+    def test_fragment(self):
+        self.assertEqual(fed(b'<div><p>1</p><p>2</p></div>').tag, 'div')
+        for page in (b'<p>a</p>', b'  <table><tr><td>1</td></tr></table>\n',
+                     b'text only', b'<!-- c --><p>x</p>'):
+            self.assertFromstring(page)
+
+    def test_fragments(self):
+        self.assertEqual(fed(b'<p>a</p><p>b</p>').tag, 'div')
+        self.assertEqual(fed(b'<b>a</b> and <i>b</i>').tag, 'span')
+        self.assertFromstring(b'<p>a</p><p>b</p>')
+
+    def test_chunks(self):
+        page = b'<div>' + b'<p>para</p>' * stream.FEED_CHUNK + b'</div>'
+        self.assertEqual(fed(page).tag, 'div')
+
+
+class TestEngines(unittest.TestCase):
+    'a --stream run writes what reading each whole page does'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pages = []
+        for n in range(1, 4):
+            self.pages.append(os.path.join(self.dir, 'doc{}.html'.format(n)))
+            with open(self.pages[-1], 'w') as f:
+                f.write(PAGE.format(n=n))
+        self.script = os.path.join(self.dir, 's.scrape')
+        with open(self.script, 'w') as f:
+            f.write(SCRIPT)
+        self.batch = scrape.BATCH
+        scrape.BATCH = True
+
+    def tearDown(self):
+        scrape.BATCH = self.batch
+        shutil.rmtree(self.dir)
+
+    def run_batch(self, streaming, **settings):
+        output = os.path.join(self.dir, 'stream.csv' if streaming else 'tree.csv')
+        cmd = scrape.MainCmd()
+        cmd.headless = cmd.overwrite = True
+        cmd.stream, cmd.maxcellsize = streaming, 512
+        cmd.stderr = StringIO()   # (its "wrote ..." reports)
+        cmd.single_output = output
+        for name, value in settings.items():
+            setattr(cmd, name, value)
+        cmd.run_batch(self.pages, self.script)
+        with open(output) as f:
+            return f.read()
+
+    def test_streamable(self):
+        self.assertIsNotNone(plan.load(self.script, scrape.MainCmd()).stream)
+
+    def test_same_output(self):
+        tree = self.run_batch(False)
+        self.assertIn('Title 2,J2,ref a2', tree)
+        self.assertEqual(self.run_batch(True), tree)
+
+    def test_same_output_populous(self):
+        self.assertEqual(self.run_batch(True, populous=True),
+                         self.run_batch(False, populous=True))
+
+
+if __name__ == '__main__':
+    unittest.main()